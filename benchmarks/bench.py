@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# Measures end-to-end latency of the tasks.py orchestration against stand-in programs, together with the amount
+# of flake evaluations and ssh sessions each task needs.
+#
+# USAGE; python3 benchmarks/bench.py [--repeat 3] [--time-scale 0.1] [--only rebuild] [--json]
+#
+# NOTE; Wall time includes the (scaled) sleep of each stand-in program. Improvements in caching, parallelism and
+# pipelining show up as lower wall time, fewer evaluations or fewer ssh sessions.
+# SEEALSO; harness.py
+
+import argparse
+import json
+import statistics
+import sys
+from collections.abc import Callable
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from harness import (
+    DISK_IMAGE_SIZE,
+    STORE_PREFIX,
+    count_evaluations,
+    count_ssh_sessions,
+    fake_tools,
+    http_stub,
+    noop_rules,
+    tcp_stub,
+)
+
+
+@dataclass
+class Scenario:
+    name: str
+    arguments: list[str]
+    # Data provided on stdin of the task, eg confirmations
+    stdin: str = ""
+    # Invocations executed before measuring, eg to warm caches
+    setup: list[list[str]] = field(default_factory=list)
+    # Amount of local stand-in (ssh) services, all hosts resolve to localhost when used.
+    # The ports are substituted into the arguments as {port0}, {port1}, ..
+    listeners: int = 0
+    # Rules prepended to the default rules of the stand-in programs
+    rules: dict[str, list[dict]] = field(default_factory=dict)
+    # The task is expected to fail, eg a failure path is measured
+    expect_failure: bool = False
+    # Status of the declared services, after the amount of healthy requests, eg to fail the probe after activation
+    service_status: int = 200
+    service_healthy: int = 0
+    # Assertions on the executions of the stand-in programs (and the root directory of the fakes), raises on mismatch
+    verify: Callable[[list[dict], Path], None] | None = None
+
+
+def verify_disk_image(records: list[dict], root: Path) -> None:
+    device = root / "disk.img"
+    if not device.is_file() or device.stat().st_size != DISK_IMAGE_SIZE:
+        raise AssertionError(f"Disk image was not written onto {device}")
+
+
+def verify_rollback(records: list[dict], root: Path) -> None:
+    previous = STORE_PREFIX + "-nixos-system-previous"
+    if not any(
+        x["tool"] == "ssh"
+        and f"{previous}/bin/switch-to-configuration switch" in x["argv"][-1]
+        for x in records
+    ):
+        raise AssertionError(f"Rollback to {previous} was not activated")
+    verify_rollout_stopped(records, root)
+
+
+def verify_rollout_stopped(records: list[dict], root: Path) -> None:
+    if any(
+        x["tool"] == "nixos-rebuild" and "freddy" in " ".join(x["argv"])
+        for x in records
+    ):
+        raise AssertionError("Rollout continued after the failing host")
+
+
+SCENARIOS = [
+    # Startup cost of tasks.py, paid on every invocation and (invoke) shell completion
+    Scenario("list", ["--list"]),
+    Scenario("check-host", ["check", "buddy"]),
+    Scenario("ci", ["ci"]),
+    Scenario("ci-metrics", ["ci", "--metrics"]),
+    Scenario("rebuild", ["rebuild", "buddy"], stdin="y\n"),
+    Scenario("rebuild-yes", ["rebuild", "buddy", "--yes"]),
+    Scenario("rebuild-batch", ["batch", "--json", "--yes", "rebuild", "freddy"]),
+    Scenario("rebuild-mixed", ["rebuild", "buddy,freddy", "--yes"]),
+    Scenario("rebuild-noop", ["rebuild", "buddy,freddy", "--yes"], rules=noop_rules()),
+    Scenario("rebuild-no-probe", ["rebuild", "buddy,freddy", "--yes", "--no-probe"]),
+    # The services of the first host turn unhealthy after activation (2 healthy requests for the baseline probe)
+    Scenario(
+        "rebuild-unhealthy",
+        ["rebuild", "buddy,freddy", "--yes"],
+        service_status=500,
+        service_healthy=2,
+        expect_failure=True,
+        verify=verify_rollback,
+    ),
+    Scenario(
+        "rebuild-rollback-failure",
+        ["rebuild", "buddy,freddy", "--yes"],
+        rules={"nix": [{"pattern": r"^copy --to ssh-ng://", "exit": 1}]},
+        service_status=500,
+        service_healthy=2,
+        expect_failure=True,
+        verify=verify_rollout_stopped,
+    ),
+    Scenario("probe", ["probe"]),
+    Scenario(
+        "deploy",
+        ["batch", "--yes", "deploy", "01-fart", "root@158.101.202.58"],
+    ),
+    Scenario(
+        "deploy-image",
+        [
+            "batch",
+            "--yes",
+            "deploy",
+            "01-fart",
+            "root@158.101.202.58",
+            "--image",
+            "--device",
+            "main={root}/disk.img",
+        ],
+        verify=verify_disk_image,
+    ),
+    # Writing onto the device fails on the target
+    Scenario(
+        "deploy-image-failure",
+        [
+            "batch",
+            "--yes",
+            "deploy",
+            "01-fart",
+            "root@158.101.202.58",
+            "--image",
+            "--device",
+            "main={root}/missing/disk.img",
+        ],
+        expect_failure=True,
+    ),
+    Scenario("filesystem-rebuild", ["batch", "--yes", "filesystem-rebuild", "buddy"]),
+    Scenario("unlock", ["unlock", "freddy"]),
+    Scenario(
+        "unlock-fleet",
+        [
+            "batch",
+            "--json",
+            "unlock",
+            "all",
+            "--initrd-port",
+            "{port0}",
+            "--ssh-port",
+            "{port1}",
+            "--interval",
+            "1",
+        ],
+        stdin="passphrase\n",
+        listeners=2,
+    ),
+    # Hosts that stayed up, the pre-boot environment port is closed
+    Scenario(
+        "unlock-fleet-up",
+        [
+            "batch",
+            "--json",
+            "unlock",
+            "all",
+            "--initrd-port",
+            "1",
+            "--ssh-port",
+            "{port0}",
+            "--interval",
+            "1",
+        ],
+        stdin="passphrase\n",
+        listeners=1,
+    ),
+    Scenario("documentation-cold", ["documentation", "--incremental"]),
+    Scenario(
+        "documentation-warm",
+        ["documentation", "--incremental"],
+        setup=[["documentation", "--incremental"]],
+    ),
+    Scenario("secrets-verify-cold", ["secrets-verify"]),
+    Scenario("secrets-verify-warm", ["secrets-verify"], setup=[["secrets-verify"]]),
+    Scenario("pins", ["pins", "--refresh", "--prune"]),
+    Scenario("cache-push-cold", ["cache-push", "file:///tmp/fake-binary-cache"]),
+    Scenario(
+        "cache-push-warm",
+        ["cache-push", "file:///tmp/fake-binary-cache"],
+        setup=[["cache-push", "file:///tmp/fake-binary-cache"]],
+    ),
+]
+
+
+def run_scenario(scenario: Scenario, repeat: int, time_scale: float) -> dict:
+    durations = []
+    records: list[dict] = []
+    for _ in range(repeat):
+        # NOTE; Fresh fakes and cache directory for each run, so runs don't influence each other
+        with ExitStack() as stack:
+            ports = [stack.enter_context(tcp_stub()) for _ in range(scenario.listeners)]
+            service_port = stack.enter_context(
+                http_stub(scenario.service_status, scenario.service_healthy)
+            )
+            tools = stack.enter_context(
+                fake_tools(
+                    time_scale=time_scale,
+                    address="127.0.0.1" if scenario.listeners else None,
+                    service_port=service_port,
+                )
+            )
+            for tool, rules in scenario.rules.items():
+                tools.rules[tool] = rules + tools.rules[tool]
+            tools.write_rules()
+            placeholders = {f"port{i}": str(x) for i, x in enumerate(ports)}
+            placeholders["root"] = tools.root.as_posix()
+            arguments = [x.format(**placeholders) for x in scenario.arguments]
+
+            for setup in scenario.setup:
+                tools.invoke(*setup)
+            tools.reset_log()
+            durations.append(
+                tools.invoke(
+                    *arguments,
+                    stdin=scenario.stdin,
+                    expect_failure=scenario.expect_failure,
+                )
+            )
+            records = tools.records()
+            if scenario.verify:
+                scenario.verify(records, tools.root)
+
+    return {
+        "scenario": scenario.name,
+        "wall_median": statistics.median(durations),
+        "wall_min": min(durations),
+        "evaluations": count_evaluations(records),
+        "ssh_sessions": count_ssh_sessions(records),
+        "executions": len(records),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark tasks.py against stand-in programs."
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario")
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=0.1,
+        help="Multiplier for the duration of each stand-in program",
+    )
+    parser.add_argument(
+        "--only", action="append", default=[], help="Only run scenarios with this name"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Emit JSON lines instead of a table"
+    )
+    args = parser.parse_args()
+
+    scenarios = [x for x in SCENARIOS if not args.only or x.name in args.only]
+    if not scenarios:
+        print(f"No scenarios selected, choose from {[x.name for x in SCENARIOS]}")
+        return 1
+
+    if not args.json:
+        print(
+            f"{'scenario':<22} {'wall (s)':>9} {'min (s)':>9} {'evals':>6} {'ssh':>5} {'execs':>6}"
+        )
+
+    for scenario in scenarios:
+        result = run_scenario(scenario, args.repeat, args.time_scale)
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            print(
+                f"{result['scenario']:<22} {result['wall_median']:>9.2f} {result['wall_min']:>9.2f} "
+                f"{result['evaluations']:>6} {result['ssh_sessions']:>5} {result['executions']:>6}",
+                flush=True,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
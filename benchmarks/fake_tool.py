@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Stand-in for the external programs that tasks.py executes (nix, ssh, sops, ...).
+#
+# NOTE; This file is symlinked under the name of each faked program, the behaviour is selected by the name this
+# program is started with.
+# SEEALSO; harness.py
+#
+# Environment;
+#   FAKE_TOOLS_CONFIG       Path to JSON file with rules per program name
+#   FAKE_TOOLS_LOG          Path to JSON-lines file receiving one record per execution
+#   FAKE_TOOLS_TIME_SCALE   Multiplier for all sleep durations (default 1.0)
+#
+# Rule format, the first rule where the regex pattern matches the space-joined arguments is used;
+#   {"pattern": "eval .*#facts", "sleep": 3.0, "stdout": "{...}", "stderr": "", "exit": 0, "consume_stdin": false,
+#    "out_link": false, "files": {}, "execute": false}
+# "files" creates files (relative to the working directory) of the provided size in bytes.
+# "execute" runs the last argument as bash script with the stdin of the fake, eg the remote command of ssh. The exit
+# code of the script is the exit code of the fake.
+# Named groups of the pattern are substituted into stdout, eg pattern "nixosConfigurations\\.(?P<host>[^.]+)\\."
+# with stdout "/nix/store/aaaa-nixos-system-{host}".
+
+import fcntl
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+def substitute(text: str, groups: dict[str, str]) -> str:
+    # NOTE; Not using str.format because canned output is often JSON, which is full of braces
+    for name, value in groups.items():
+        text = text.replace(f"{{{name}}}", value or "")
+    return text
+
+
+def main() -> int:
+    tool = Path(sys.argv[0]).name
+    arguments = sys.argv[1:]
+    joined_arguments = " ".join(arguments)
+
+    with open(os.environ["FAKE_TOOLS_CONFIG"], "r") as file_handle:
+        config = json.load(file_handle)
+    time_scale = float(os.environ.get("FAKE_TOOLS_TIME_SCALE", "1.0"))
+
+    rule = {}
+    groups = {}
+    for candidate in config.get(tool, []):
+        match = re.search(candidate.get("pattern", ""), joined_arguments)
+        if match:
+            rule = candidate
+            groups = match.groupdict()
+            break
+
+    start = time.time()
+    stdin_size = None
+    if rule.get("consume_stdin", False):
+        stdin_size = len(sys.stdin.buffer.read())
+
+    time.sleep(float(rule.get("sleep", 0)) * time_scale)
+
+    for name, size in rule.get("files", {}).items():
+        # NOTE; Some non-zero content, so sparse writes and checksums are exercised
+        with open(name, "wb") as file_handle:
+            file_handle.write(bytes(range(256)) * (size // 256) + bytes(size % 256))
+
+    exit_code = int(rule.get("exit", 0))
+    if rule.get("execute", False) and arguments:
+        exit_code = subprocess.run(
+            ["bash", "-c", arguments[-1]], check=False
+        ).returncode
+
+    if rule.get("out_link", False) and "--out-link" in arguments:
+        # NOTE; Stand-in for the build result, the out-link points into a directory next to the log
+        result = Path(os.environ["FAKE_TOOLS_LOG"]).parent / "store" / tool
+        result.mkdir(parents=True, exist_ok=True)
+        link = Path(arguments[arguments.index("--out-link") + 1])
+        link.unlink(missing_ok=True)
+        link.symlink_to(result)
+
+    if "stdout" in rule:
+        sys.stdout.write(substitute(rule["stdout"], groups))
+        sys.stdout.flush()
+    if "stderr" in rule:
+        sys.stderr.write(substitute(rule["stderr"], groups))
+        sys.stderr.flush()
+
+    record = {
+        "tool": tool,
+        "argv": arguments,
+        "start": start,
+        "end": time.time(),
+        "rule": rule.get("pattern"),
+        "stdin_size": stdin_size,
+    }
+    # NOTE; Multiple fakes can execute concurrently, lock the log while appending
+    with open(os.environ["FAKE_TOOLS_LOG"], "a") as file_handle:
+        fcntl.flock(file_handle, fcntl.LOCK_EX)
+        file_handle.write(json.dumps(record) + "\n")
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,485 @@
+# Puts stand-in programs on PATH and executes tasks.py against them.
+#
+# USAGE;
+#   with fake_tools() as tools:
+#       duration = tools.invoke("rebuild", "buddy", "--yes")
+#       print(tools.records())
+#
+# SEEALSO; fake_tool.py
+# SEEALSO; bench.py
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from copy import deepcopy
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+
+PROJECT_DIR = Path(__file__).parent.parent.resolve()
+FAKE_TOOL = Path(__file__).parent / "fake_tool.py"
+
+# Programs executed by tasks.py
+TOOLS = [
+    "nix",
+    "nix-store",
+    "nix-fast-build",
+    "nixos-rebuild",
+    "nixos-anywhere",
+    "sops",
+    "rage",
+    "rage-keygen",
+    "ssh",
+    "sudo",
+    # Output of the diskoImagesScript build, see default_rules
+    "disko-images",
+]
+
+# Copy of the relevant host facts, see flake/nixosConfigurations/*/facts.nix
+FACTS: dict[str, dict[str, Any]] = {
+    "buddy": {
+        "hostName": "buddy",
+        "domainName": "internal.proesmans.eu",
+        "encryptedDisks": False,
+        "service": {
+            "reverse-proxy": {
+                "port": 443,
+                "uri": "https://buddy.internal.proesmans.eu",
+            },
+            "kanidm": {"port": 443, "uri": "https://buddy.internal.proesmans.eu"},
+            "kanidm-replication": {
+                "port": 8444,
+                "uri": "repl://buddy.internal.proesmans.eu:8444",
+            },
+        },
+    },
+    "freddy": {
+        "hostName": "freddy",
+        "domainName": "omega.proesmans.eu",
+        "encryptedDisks": True,
+        "service": {
+            "reverse-proxy": {"port": 443, "uri": "https://freddy.omega.proesmans.eu"},
+            "kanidm": {"port": 443, "uri": "https://freddy.omega.proesmans.eu"},
+            "kanidm-replication": {
+                "port": 8444,
+                "uri": "repl://freddy.omega.proesmans.eu:8444",
+            },
+        },
+    },
+    "01-fart": {
+        "hostName": "01-fart",
+        "domainName": "omega.proesmans.eu",
+        "encryptedDisks": True,
+        "service": {},
+    },
+    "02-fart": {
+        "hostName": "02-fart",
+        "domainName": "omega.proesmans.eu",
+        "encryptedDisks": True,
+        "service": {},
+    },
+}
+
+# Copy of nix.buildMachines of the development host
+BUILDER: dict[str, Any] = {
+    "hostName": "141.148.244.144",
+    "protocol": "ssh-ng",
+    "sshUser": "builder",
+    "sshKey": "/run/secrets/freddy-builder-ssh-key",
+    "systems": ["aarch64-linux"],
+    "maxJobs": 2,
+    "speedFactor": 10,
+    "supportedFeatures": ["nixos-test", "benchmark", "big-parallel", "kvm"],
+    "mandatoryFeatures": [],
+    "publicHostKey": None,
+}
+
+# Size of each disk image created by the stand-in diskoImagesScript
+DISK_IMAGE_SIZE = 8 * 1024**2
+
+HOST_PATTERN = r"nixosConfigurations\.(?P<host>[^.#\s]+)\."
+STORE_PREFIX = "/nix/store/0123456789abcdfghijklmnpqrsvwxyz"
+
+
+def store_path_info() -> dict[str, dict[str, Any]]:
+    """
+    Output of "nix path-info --json --recursive --closure-size" for the system closures of all hosts.
+    """
+    shared = {
+        STORE_PREFIX + "-glibc-2.40": 40 * 1024**2,
+        STORE_PREFIX + "-systemd-257": 120 * 1024**2,
+    }
+    info: dict[str, dict[str, Any]] = {
+        path: {"narSize": size, "closureSize": size, "references": []}
+        for path, size in shared.items()
+    }
+    for name in FACTS:
+        etc = STORE_PREFIX + f"-etc-{name}"
+        info[etc] = {
+            "narSize": 1024**2,
+            "closureSize": 1024**2,
+            "references": list(shared),
+        }
+        info[STORE_PREFIX + f"-nixos-system-{name}"] = {
+            "narSize": 64 * 1024,
+            "closureSize": 64 * 1024 + 1024**2 + sum(shared.values()),
+            "references": [etc, *shared],
+        }
+    return info
+
+
+def default_rules(
+    address: str | None = None, service_port: int | None = None
+) -> dict[str, list[dict[str, Any]]]:
+    """
+    Canned behaviour with durations in the ballpark of a warm nix evaluation cache on the development host.
+    All hosts resolve to the provided address, if any, eg to point them at a local stand-in service.
+    All declared services point to the provided local port, if any, eg to point them at a local stand-in HTTP service.
+    """
+    connection_strings = {
+        name: address or f"{v['hostName']}.{v['domainName']}"
+        for name, v in FACTS.items()
+    }
+    services = {
+        name: {
+            service: {
+                "port": service_port or x["port"],
+                "uri": (
+                    f"{'http' if x['uri'].startswith('http') else x['uri'].split(':')[0]}://127.0.0.1:{service_port}"
+                    if service_port
+                    else x["uri"]
+                ),
+            }
+            for service, x in v["service"].items()
+        }
+        for name, v in FACTS.items()
+    }
+    return {
+        "nix": [
+            {
+                "pattern": r"eval .*builtins\.currentSystem",
+                "sleep": 0.3,
+                "stdout": "x86_64-linux",
+            },
+            {
+                "pattern": r"(?s)eval .*#facts.*encryptedDisks",
+                "sleep": 3.0,
+                "stdout": json.dumps(
+                    {
+                        name: {
+                            "connection": connection_strings[name],
+                            "encryptedDisks": v["encryptedDisks"],
+                            "service": services[name],
+                        }
+                        for name, v in FACTS.items()
+                    }
+                ),
+            },
+            {
+                "pattern": r"eval .*#facts",
+                "sleep": 3.0,
+                "stdout": json.dumps(connection_strings),
+            },
+            {
+                "pattern": r"eval .*#nixosConfigurations --apply",
+                "sleep": 6.0,
+                "stdout": json.dumps(
+                    {
+                        "platforms": {
+                            name: "aarch64-linux"
+                            if name == "freddy"
+                            else "x86_64-linux"
+                            for name in FACTS
+                        },
+                        "builders": [BUILDER],
+                    }
+                ),
+            },
+            {
+                "pattern": r"eval .*" + HOST_PATTERN + r".*outPath",
+                "sleep": 8.0,
+                "stdout": STORE_PREFIX + "-nixos-system-{host}",
+            },
+            {
+                "pattern": r"eval .*" + HOST_PATTERN + r".*disko\.devices\.disk",
+                "sleep": 6.0,
+                "stdout": json.dumps({"main": "/dev/sda"}),
+            },
+            {
+                "pattern": r"build .*diskoImagesScript",
+                "sleep": 10.0,
+                "stdout": "disko-images",
+            },
+            {
+                "pattern": r"path-info --json --recursive --closure-size",
+                "sleep": 0.5,
+                "stdout": json.dumps(store_path_info()),
+            },
+            {
+                "pattern": r"path-info .*--recursive .*" + HOST_PATTERN,
+                "sleep": 8.5,
+                "stdout": "\n".join(
+                    [
+                        STORE_PREFIX + "-nixos-system-{host}",
+                        STORE_PREFIX + "-etc-{host}",
+                        STORE_PREFIX + "-glibc-2.40",
+                        STORE_PREFIX + "-systemd-257",
+                    ]
+                ),
+            },
+            {
+                "pattern": r"(path-info|build) .*" + HOST_PATTERN,
+                "sleep": 8.5,
+                "stdout": STORE_PREFIX + "-nixos-system-{host}",
+            },
+            {"pattern": r"^build .*--out-link", "sleep": 15.0, "out_link": True},
+            {"pattern": r"^build ", "sleep": 15.0},
+            {"pattern": r"^copy ", "sleep": 5.0, "consume_stdin": True},
+            {"pattern": r"^fmt ", "sleep": 1.0},
+        ],
+        "nix-store": [{"pattern": r"--add-root", "sleep": 0.2}],
+        "nix-fast-build": [{"pattern": "", "sleep": 20.0}],
+        "nixos-rebuild": [{"pattern": "", "sleep": 30.0}],
+        "nixos-anywhere": [{"pattern": "", "sleep": 120.0}],
+        "sops": [
+            {
+                "pattern": r"decrypt",
+                "sleep": 0.4,
+                "stdout": "AGE-SECRET-KEY-1FAKEHOSTKEY",
+            },
+            {"pattern": "", "sleep": 0.4},
+        ],
+        "rage": [
+            {
+                "pattern": r"--decrypt",
+                "sleep": 0.5,
+                "stdout": "AGE-SECRET-KEY-1FAKEDEVELOPMENTKEY",
+            }
+        ],
+        "rage-keygen": [
+            {
+                "pattern": "",
+                "stdout": "# created: 2024-01-01T00:00:00Z\n# public key: age1fake\nAGE-SECRET-KEY-1FAKE\n",
+            }
+        ],
+        "ssh": [
+            {
+                # Hosts run an older system by default
+                "pattern": r"readlink -f /run/current-system",
+                "sleep": 0.8,
+                "stdout": "\n".join([STORE_PREFIX + "-nixos-system-previous"] * 3),
+            },
+            {
+                # Disk image stream, written locally onto the device path (eg a loop file)
+                "pattern": r"zstd --decompress",
+                "sleep": 0.8,
+                "execute": True,
+            },
+            {
+                "pattern": r"/proc/loadavg",
+                "sleep": 0.8,
+                "stdout": "0.52 0.58 0.59 1/467 12345\n4\n",
+            },
+            {"pattern": "", "sleep": 0.8},
+        ],
+        "sudo": [{"pattern": "", "sleep": 30.0}],
+        "disko-images": [
+            {"pattern": "", "sleep": 60.0, "files": {"main.raw": DISK_IMAGE_SIZE}}
+        ],
+    }
+
+
+class FakeTools:
+    def __init__(
+        self, root: Path, rules: dict[str, list[dict[str, Any]]], time_scale: float
+    ):
+        self.root = root
+        self.bin_dir = root / "bin"
+        self.config_file = root / "config.json"
+        self.log_file = root / "log.jsonl"
+        self.cache_dir = root / "cache"
+        self.time_scale = time_scale
+        self.rules = rules
+
+        self.bin_dir.mkdir()
+        self.cache_dir.mkdir()
+        for tool in TOOLS:
+            (self.bin_dir / tool).symlink_to(FAKE_TOOL)
+        self.write_rules()
+
+    def write_rules(self) -> None:
+        """
+        Persist the (modified) rules, the fakes read them on each execution.
+        """
+        self.config_file.write_text(json.dumps(self.rules))
+
+    def environment(self) -> dict[str, str]:
+        environment = os.environ.copy()
+        environment["PATH"] = f"{self.bin_dir}:{environment.get('PATH', '')}"
+        environment["FAKE_TOOLS_CONFIG"] = self.config_file.as_posix()
+        environment["FAKE_TOOLS_LOG"] = self.log_file.as_posix()
+        environment["FAKE_TOOLS_TIME_SCALE"] = str(self.time_scale)
+        # Isolate CACHE_DIR of tasks.py
+        environment["XDG_CACHE_HOME"] = self.cache_dir.as_posix()
+        return environment
+
+    def reset_log(self) -> None:
+        self.log_file.unlink(missing_ok=True)
+
+    def records(self) -> list[dict[str, Any]]:
+        if not self.log_file.is_file():
+            return []
+        return [json.loads(x) for x in self.log_file.read_text().splitlines() if x]
+
+    def invoke(
+        self, *arguments: str, stdin: str = "", expect_failure: bool = False
+    ) -> float:
+        """
+        Run an invoke task (from tasks.py) against the fakes, returns the wall time in seconds.
+        Raises when the task fails unexpectedly, or succeeds while failure is expected.
+        """
+        start = time.monotonic()
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "invoke",
+                "--search-root",
+                PROJECT_DIR.as_posix(),
+                *arguments,
+            ],
+            env=self.environment(),
+            input=stdin,
+            text=True,
+            capture_output=True,
+            check=False,  # Failure can be the expected result
+        )
+        duration = time.monotonic() - start
+        if (result.returncode != 0) != expect_failure:
+            raise RuntimeError(
+                f"Task {' '.join(arguments)} exited with {result.returncode}\n{result.stderr[-2000:]}"
+            )
+        return duration
+
+
+@contextmanager
+def tcp_stub(banner: bytes = b"SSH-2.0-stub\r\n"):
+    """
+    Local TCP service that greets each connection with the banner. Yields the listening port.
+    """
+    server = socket.create_server(("127.0.0.1", 0))
+    server.settimeout(0.2)
+    stop = threading.Event()
+
+    def serve() -> None:
+        while not stop.is_set():
+            try:
+                connection, _ = server.accept()
+            except TimeoutError:
+                continue
+            with connection:
+                connection.sendall(banner)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    try:
+        yield server.getsockname()[1]
+    finally:
+        stop.set()
+        thread.join()
+        server.close()
+
+
+@contextmanager
+def http_stub(status: int = 200, healthy: int = 0):
+    """
+    Local HTTP service that answers each request with the status. The first <healthy> requests are answered with 200
+    instead, eg to turn unhealthy after an activation. Yields the listening port.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    requests = iter(range(healthy))
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            self.send_response(200 if next(requests, None) is not None else status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *arguments: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address[1]
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+@contextmanager
+def fake_tools(
+    rules: dict[str, list[dict[str, Any]]] | None = None,
+    time_scale: float = 1.0,
+    address: str | None = None,
+    service_port: int | None = None,
+):
+    if rules is None:
+        rules = default_rules(address, service_port)
+
+    with TemporaryDirectory(prefix="fake-tools-") as root:
+        yield FakeTools(Path(root), deepcopy(rules), time_scale)
+
+
+def noop_rules() -> dict[str, list[dict[str, Any]]]:
+    """
+    Rules to prepend for hosts that already run the system that is about to be activated.
+    """
+    return {
+        "ssh": [
+            {
+                "pattern": r"(?P<host>[^@.\s]+)\.\S+ readlink -f /run/current-system",
+                "sleep": 0.8,
+                "stdout": "\n".join([STORE_PREFIX + "-nixos-system-{host}"] * 3),
+            }
+        ]
+    }
+
+
+def count_evaluations(records: list[dict[str, Any]]) -> int:
+    """
+    Executions that (re-)evaluate the flake, aka have a flake reference as argument.
+    """
+    return sum(
+        1
+        for x in records
+        if x["tool"] in ("nix", "nix-fast-build", "nixos-rebuild", "nixos-anywhere")
+        and any("#" in argument for argument in x["argv"])
+    )
+
+
+def count_ssh_sessions(records: list[dict[str, Any]]) -> int:
+    """
+    Executions that open a connection over ssh, directly or through the nix tooling.
+    """
+    sessions = 0
+    for record in records:
+        if record["tool"] == "ssh":
+            sessions += 1
+            continue
+        arguments = record["argv"]
+        for index, argument in enumerate(arguments):
+            if argument.startswith(("ssh://", "ssh-ng://")) or (
+                argument in ("--target-host", "--build-host")
+                and index + 1 < len(arguments)
+            ):
+                sessions += 1
+    return sessions
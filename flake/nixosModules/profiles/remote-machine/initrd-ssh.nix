@@ -37,7 +37,7 @@ in
         # To prevent ssh clients from freaking out because a different host key is used,
         # a different port for ssh is useful (assuming the same host has also a regular sshd running)
         #
-        # WARN; Port must be the same as defined in tasks.py:unlock()!
+        # WARN; Port must be the same as defined in tasks.py:INITRD_SSH_PORT!
         port = 23;
         hostKeys = [
           # Doesn't work for shit, weird documentation and general lack of affordance.
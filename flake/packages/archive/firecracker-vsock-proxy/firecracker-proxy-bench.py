@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# Replays a traffic trace through firecracker-proxy.py, against a stand-in for the firecracker Unix-socket
+# multiplexer. Reports throughput, per-chunk latency and CPU time of the proxy process.
+#
+# USAGE; Capture a trace from production traffic
+#   ssh -o ProxyCommand="firecracker-vsock-proxy --capture /tmp/ssh.trace /run/vm.vsock 22" vm
+# USAGE; Or synthesize one
+#   ./firecracker-proxy-bench.py synthesize interactive /tmp/interactive.trace
+#   ./firecracker-proxy-bench.py synthesize bulk /tmp/bulk.trace
+# USAGE; Replay
+#   ./firecracker-proxy-bench.py replay /tmp/ssh.trace [--proxy ./firecracker-proxy.py] [--no-timing] [--repeat 5]
+
+import argparse
+import json
+import os
+import random
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+# WARN; Format is duplicated from firecracker-proxy.py!
+TRACE_MAGIC = b"FCTRACE1"
+TRACE_FLAG_PAYLOAD = 0x01
+TRACE_RECORD = struct.Struct("<IBI")
+DIRECTION_TO_SERVICE = 0
+DIRECTION_FROM_SERVICE = 1
+
+# Give up on a replay that doesn't progress
+REPLAY_TIMEOUT = 60
+
+
+def read_trace(path):
+    """
+    Returns a list of (delay microseconds, direction, size, payload or None).
+    """
+    with open(path, "rb") as file_handle:
+        if file_handle.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError(f"{path} is not a proxy trace file")
+        with_payload = file_handle.read(1)[0] & TRACE_FLAG_PAYLOAD
+
+        records = []
+        while True:
+            header = file_handle.read(TRACE_RECORD.size)
+            if len(header) < TRACE_RECORD.size:
+                return records
+            delay, direction, size = TRACE_RECORD.unpack(header)
+            payload = file_handle.read(size) if with_payload else None
+            records.append((delay, direction, size, payload))
+
+
+def write_trace(path, records):
+    with open(path, "wb") as file_handle:
+        file_handle.write(TRACE_MAGIC)
+        file_handle.write(bytes([0]))
+        file_handle.writelines(TRACE_RECORD.pack(*record) for record in records)
+
+
+def synthesize(kind, count, seed):
+    """
+    Interactive; keystrokes with echo and the occasional screen update.
+    Bulk; a small request followed by a large stream of full chunks, eg scp or nix copy.
+    """
+    rng = random.Random(seed)
+    records = []
+    if kind == "interactive":
+        for _ in range(count):
+            records.append((rng.randint(50_000, 250_000), DIRECTION_TO_SERVICE, 36))
+            records.append((rng.randint(200, 2_000), DIRECTION_FROM_SERVICE, 36))
+            if rng.random() < 0.1:
+                records.append(
+                    (
+                        rng.randint(200, 2_000),
+                        DIRECTION_FROM_SERVICE,
+                        rng.randint(200, 4096),
+                    )
+                )
+    elif kind == "bulk":
+        records.append((0, DIRECTION_TO_SERVICE, 512))
+        for _ in range(count):
+            records.append((rng.randint(0, 50), DIRECTION_FROM_SERVICE, 4096))
+        records.append((100, DIRECTION_TO_SERVICE, 64))
+    else:
+        raise ValueError(f"Unknown trace kind {kind}")
+    return records
+
+
+def receive_exactly(read, size):
+    remaining = size
+    while remaining:
+        data = read(min(remaining, 1024 * 1024))
+        if not data:
+            raise EOFError("Connection closed during replay")
+        remaining -= len(data)
+
+
+def replay_side(
+    records, direction, send, read, start, timing, send_times, receive_times
+):
+    """
+    Walk the trace in order. Send the chunks of the provided direction at their recorded time offset, and
+    receive the chunks of the other direction. Causality of the trace is preserved because each side blocks on
+    receiving before continuing.
+    """
+    offset = 0
+    for index, (delay, record_direction, size, payload) in enumerate(records):
+        offset += delay
+        if record_direction == direction:
+            if timing:
+                wait = start + offset / 1_000_000 - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            send_times[index] = time.monotonic()
+            send(payload if payload is not None else bytes(size))
+        else:
+            receive_exactly(read, size)
+            receive_times[index] = time.monotonic()
+
+
+def fake_multiplexer(
+    server,
+    records,
+    handshake_event,
+    start_event,
+    start,
+    timing,
+    send_times,
+    receive_times,
+    errors,
+):
+    """
+    Firecracker stand-in; accept one connection, complete the handshake and act as the guest service.
+    """
+    try:
+        connection, _ = server.accept()
+        with connection:
+            request = b""
+            while not request.endswith(b"\n"):
+                data = connection.recv(64)
+                if not data:
+                    raise EOFError("Proxy closed before handshake")
+                request += data
+            if not request.startswith(b"CONNECT "):
+                raise ValueError(f"Unexpected handshake {request!r}")
+            connection.sendall(b"OK 1073741824\n")
+            handshake_event.set()
+
+            start_event.wait()
+            replay_side(
+                records,
+                DIRECTION_FROM_SERVICE,
+                connection.sendall,
+                connection.recv,
+                start[0],
+                timing,
+                send_times,
+                receive_times,
+            )
+            # Let the proxy drain before closing
+            connection.shutdown(socket.SHUT_WR)
+            while connection.recv(65536):
+                pass
+    except (OSError, EOFError, ValueError) as e:
+        errors.append(e)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))]
+
+
+def replay(proxy_path, records, timing, proxy_arguments):
+    with TemporaryDirectory(prefix="proxy-bench-") as directory:
+        socket_path = Path(directory) / "firecracker.vsock"
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path.as_posix())
+        server.listen()
+        server.settimeout(REPLAY_TIMEOUT)
+
+        send_times = [None] * len(records)
+        receive_times = [None] * len(records)
+        errors = []
+        handshake_event = threading.Event()
+        start_event = threading.Event()
+        # Monotonic clock value all trace offsets are relative to
+        start = []
+
+        multiplexer = threading.Thread(
+            target=fake_multiplexer,
+            args=(
+                server,
+                records,
+                handshake_event,
+                start_event,
+                start,
+                timing,
+                send_times,
+                receive_times,
+                errors,
+            ),
+            daemon=True,
+        )
+        multiplexer.start()
+
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                proxy_path,
+                *proxy_arguments,
+                socket_path.as_posix(),
+                "22",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=0,
+        )
+
+        def send_stdin(data):
+            process.stdin.write(data)
+
+        # NOTE; Start the clock after the handshake, only the proxy path is measured
+        if not handshake_event.wait(REPLAY_TIMEOUT):
+            process.kill()
+            raise TimeoutError("Proxy did not complete the handshake")
+        start.append(time.monotonic())
+        start_event.set()
+        wall_start = time.monotonic()
+        try:
+            replay_side(
+                records,
+                DIRECTION_TO_SERVICE,
+                send_stdin,
+                process.stdout.read,
+                start[0],
+                timing,
+                send_times,
+                receive_times,
+            )
+        finally:
+            process.stdin.close()
+            multiplexer.join(REPLAY_TIMEOUT)
+            # NOTE; wait4 provides the resource usage of exactly this child process
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            process.stdout.close()
+            server.close()
+        wall = time.monotonic() - wall_start
+
+        if errors:
+            raise errors[0]
+
+    latencies = [
+        receive - send
+        for send, receive in zip(send_times, receive_times)
+        if send is not None and receive is not None
+    ]
+    total_bytes = sum(size for _, _, size, _ in records)
+    return {
+        "chunks": len(records),
+        "bytes": total_bytes,
+        "wall": wall,
+        "throughput_mib": total_bytes / wall / (1024 * 1024),
+        "latency_p50_us": percentile(latencies, 0.50) * 1_000_000,
+        "latency_p99_us": percentile(latencies, 0.99) * 1_000_000,
+        "cpu_user": usage.ru_utime,
+        "cpu_system": usage.ru_stime,
+        "exit_code": process.returncode,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Trace based benchmark for the firecracker vsock proxy."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    synthesize_parser = commands.add_parser("synthesize", help="Generate a trace file")
+    synthesize_parser.add_argument("kind", choices=["interactive", "bulk"])
+    synthesize_parser.add_argument("output")
+    synthesize_parser.add_argument("--count", type=int, default=1000)
+    synthesize_parser.add_argument("--seed", type=int, default=0)
+
+    replay_parser = commands.add_parser(
+        "replay", help="Replay a trace file through the proxy"
+    )
+    replay_parser.add_argument("trace")
+    replay_parser.add_argument(
+        "--proxy",
+        default=(Path(__file__).parent / "firecracker-proxy.py").as_posix(),
+        help="Proxy implementation to benchmark",
+    )
+    replay_parser.add_argument(
+        "--proxy-argument",
+        action="append",
+        default=[],
+        help="Extra argument for the proxy, repeatable",
+    )
+    replay_parser.add_argument(
+        "--no-timing",
+        action="store_true",
+        help="Ignore recorded inter-arrival times and replay as fast as possible",
+    )
+    replay_parser.add_argument("--repeat", type=int, default=3)
+    replay_parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "synthesize":
+        write_trace(args.output, synthesize(args.kind, args.count, args.seed))
+        return 0
+
+    records = read_trace(args.trace)
+    for _ in range(args.repeat):
+        result = replay(args.proxy, records, not args.no_timing, args.proxy_argument)
+        if args.json:
+            print(json.dumps(result), flush=True)
+        else:
+            print(
+                f"{result['chunks']} chunks, {result['bytes']} bytes in {result['wall']:.3f}s; "
+                f"{result['throughput_mib']:.2f} MiB/s, "
+                f"latency p50 {result['latency_p50_us']:.0f}us p99 {result['latency_p99_us']:.0f}us, "
+                f"cpu {result['cpu_user']:.3f}s user {result['cpu_system']:.3f}s system",
+                flush=True,
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
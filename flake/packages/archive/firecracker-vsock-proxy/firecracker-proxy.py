@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 
 import socket
+import struct
 import sys
 import selectors
+import select
 import os
 import fcntl
 import argparse
 import re
+import time
+from collections import defaultdict, deque
+from contextlib import nullcontext
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser(
@@ -14,14 +19,48 @@ parser = argparse.ArgumentParser(
 )
 parser.add_argument(
     "socket_path",
+    nargs="?",
     help="Path to the Unix socket to proxy.",
 )
 parser.add_argument(
     "service_port",
+    nargs="?",
     help="Port to connect to, where the service is listening.",
 )
+parser.add_argument(
+    "--pool",
+    metavar="POOL_SOCKET",
+    help="Take an already handshaked connection from the pool daemon listening at this path. "
+    "Falls back to a direct connection when the pool is unavailable.",
+)
+parser.add_argument(
+    "--pool-daemon",
+    metavar="POOL_SOCKET",
+    help="Run the pool daemon, listening for proxy invocations at this path.",
+)
+parser.add_argument(
+    "--pool-size",
+    type=int,
+    default=2,
+    help="Amount of handshaked connections kept ready per (socket_path, service_port).",
+)
+parser.add_argument(
+    "--capture",
+    metavar="TRACE_FILE",
+    help="Record chunk sizes, directions and inter-arrival times of the proxied traffic into this file.",
+)
+parser.add_argument(
+    "--capture-payload",
+    action="store_true",
+    help="Also record the chunk contents into the trace file. WARN; Includes sensitive data!",
+)
 args = parser.parse_args()
 
+if not args.pool_daemon and not (args.socket_path and args.service_port):
+    parser.error(
+        "socket_path and service_port are required, unless running the pool daemon"
+    )
+
 # Define the socket path and port
 SOCKET_PATH = args.socket_path
 PORT = args.service_port
@@ -30,86 +69,349 @@ PORT = args.service_port
 # fractured by interleaving writes
 PIPE_BUF = os.sysconf("SC_PAGE_SIZE")
 
-# Set stdin to non-blocking mode
-fd_stdin = sys.stdin.fileno()
-flags = fcntl.fcntl(fd_stdin, fcntl.F_GETFL)  # Get current flags
-fcntl.fcntl(fd_stdin, fcntl.F_SETFL, flags | os.O_NONBLOCK)  # Set non-blocking
+# Firecracker multiplexing handshake reply
+PATTERN_RESPONSE = re.compile(rb"^OK \d+\n")
+# Upper bound on the length of the handshake reply line
+HANDSHAKE_REPLY_MAX = 64
+# Seconds to wait for the (remainder of the) handshake reply
+HANDSHAKE_TIMEOUT = 5
 
-sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-try:
-    sock.setblocking(False)
-    sock.connect(SOCKET_PATH)
-except BlockingIOError:
-    pass  # Ignore the error, as the connection will be established later
-
-# Setup evented I/O and proxy
-selector = selectors.DefaultSelector()
-selector.register(sock, selectors.EVENT_READ)
-
-# Firecracker multiplexing handshake
-completed_handshake = False
-buffer_handshake = bytearray()
-pattern_response = re.compile(rb"^OK \d+\n")
-sock.sendall(f"CONNECT {PORT}\n".encode())
-while not completed_handshake:
-    for key, _ in selector.select():
-        if key.fileobj == sock:
+# Trace file format; magic, flags (1 byte), then one record per chunk.
+# Record; microseconds since previous record (uint32), direction (uint8), chunk size (uint32), [payload]
+# WARN; Format is duplicated in firecracker-proxy-bench.py!
+TRACE_MAGIC = b"FCTRACE1"
+TRACE_FLAG_PAYLOAD = 0x01
+TRACE_RECORD = struct.Struct("<IBI")
+# Data from stdin towards the service
+DIRECTION_TO_SERVICE = 0
+# Data from the service towards stdout
+DIRECTION_FROM_SERVICE = 1
+
+
+class TraceWriter:
+    """
+    Append chunk records to the trace file, buffered to keep the overhead on the proxy path small.
+    The file is open while inside the context.
+    """
+
+    def __init__(self, path, payload):
+        self.path = path
+        self.payload = payload
+        self.file = None
+        self.previous = None
+
+    def __enter__(self):
+        self.file = open(self.path, "wb", buffering=1024 * 1024)
+        self.file.write(TRACE_MAGIC)
+        self.file.write(bytes([TRACE_FLAG_PAYLOAD if self.payload else 0]))
+        self.previous = time.monotonic_ns()
+        return self
+
+    def __exit__(self, *exception):
+        self.file.close()
+
+    def record(self, direction, data):
+        now = time.monotonic_ns()
+        delta = min((now - self.previous) // 1000, 0xFFFFFFFF)
+        self.previous = now
+        self.file.write(TRACE_RECORD.pack(delta, direction, len(data)))
+        if self.payload:
+            self.file.write(data)
+
+
+def receive_handshake(sock):
+    """
+    Consume exactly the handshake reply line, data from the service behind it stays in the socket buffer.
+    Returns True on a valid reply, False on an invalid reply or EOF, None if the reply is incomplete.
+    """
+    peek = sock.recv(HANDSHAKE_REPLY_MAX, socket.MSG_PEEK)
+    if not peek:
+        # EOF AF_UNIX
+        return False
+
+    end = peek.find(b"\n")
+    if end < 0:
+        return None if len(peek) < HANDSHAKE_REPLY_MAX else False
+
+    reply = sock.recv(end + 1)
+    return PATTERN_RESPONSE.match(reply) is not None
+
+
+def is_closed(sock):
+    """
+    Check, without consuming data, if the other side closed the connection.
+    """
+    poller = select.poll()
+    poller.register(sock, select.POLLRDHUP)
+    return any(
+        events & (select.POLLRDHUP | select.POLLHUP | select.POLLERR)
+        for _, events in poller.poll(0)
+    )
+
+
+def connect_direct(socket_path, port):
+    """
+    Connect and complete the firecracker multiplexing handshake.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    sock.sendall(f"CONNECT {port}\n".encode())
+
+    # NOTE; Read the reply byte by byte, data from the service behind the reply must stay in the socket buffer
+    sock.settimeout(HANDSHAKE_TIMEOUT)
+    reply = b""
+    try:
+        while not reply.endswith(b"\n") and len(reply) < HANDSHAKE_REPLY_MAX:
+            data = sock.recv(1)
+            if not data:
+                # EOF AF_UNIX
+                break
+            reply += data
+    except OSError:
+        reply = b""
+
+    if not PATTERN_RESPONSE.match(reply):
+        sock.close()
+        return None
+    sock.settimeout(None)
+    return sock
+
+
+def connect_pool(pool_path, socket_path, port):
+    """
+    Request a handshaked connection from the pool daemon. Returns None when the pool cannot provide one.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(5)
+    try:
+        client.connect(pool_path)
+        client.sendall(f"{os.path.abspath(socket_path)}\t{port}\n".encode())
+        _, fds, _, _ = socket.recv_fds(client, 16, 1)
+    except OSError:
+        return None
+    finally:
+        client.close()
+
+    if not fds:
+        return None
+    return socket.socket(fileno=fds[0])
+
+
+def pool_daemon(pool_path, size):
+    """
+    Keep handshaked connections ready for each requested (socket_path, service_port) and hand them over to proxy
+    invocations. A replacement connection is established in the background for each hand-over.
+    Connections closed by the guest while waiting are evicted and replaced.
+    """
+    if os.path.exists(pool_path):
+        os.unlink(pool_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # NOTE; The daemon connects to any socket path a client asks for, only the owner may ask.
+    # The umask closes the window between bind and chmod.
+    previous_umask = os.umask(0o177)
+    try:
+        server.bind(pool_path)
+    finally:
+        os.umask(previous_umask)
+    os.chmod(pool_path, 0o600)
+    server.listen()
+    server.setblocking(False)
+
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ, ("server", None))
+    # NOTE; Idle connections are watched for hang-up only. Services that send data first (eg SSH banner) would
+    # otherwise keep the connection readable. The epoll object itself is readable when any watched connection
+    # hangs up.
+    hangups = select.epoll()
+    selector.register(hangups, selectors.EVENT_READ, ("hangup", None))
+    # file descriptor -> (connection, key)
+    idle = {}
+
+    # (socket_path, service_port) -> connections
+    ready = defaultdict(deque)
+    handshaking = defaultdict(set)
+    # (socket_path, service_port) -> proxy invocations waiting for a connection
+    waiting = defaultdict(deque)
+
+    def refuse(client):
+        # NOTE; Message without file descriptor, the proxy falls back to a direct connection
+        try:
+            client.sendall(b"ERR\n")
+        except OSError:
+            pass
+        client.close()
+
+    def hand_over(client, sock, key):
+        try:
+            socket.send_fds(client, [b"OK\n"], [sock.fileno()])
+        except OSError:
+            pass
+        client.close()
+        sock.close()
+        refill(key)
+
+    def refill(key):
+        socket_path, port = key
+        while len(ready[key]) + len(handshaking[key]) < size + len(waiting[key]):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.setblocking(False)
             try:
-                data = sock.recv(PIPE_BUF)
-                sys.stdout.buffer.write(data)
-                sys.stdout.flush()
-                if not data:
-                    # EOF AF_UNIX
+                sock.connect(socket_path)
+                sock.sendall(f"CONNECT {port}\n".encode())
+            except OSError:
+                # Firecracker is not (yet) listening, don't retry until the next request for this key
+                sock.close()
+                if not handshaking[key]:
+                    while waiting[key]:
+                        refuse(waiting[key].popleft())
+                return
+            handshaking[key].add(sock)
+            selector.register(sock, selectors.EVENT_READ, ("handshake", key))
+
+    while True:
+        for selector_key, _ in selector.select():
+            sock = selector_key.fileobj
+            kind, key = selector_key.data
+
+            if kind == "server":
+                try:
+                    client, _ = server.accept()
+                except BlockingIOError:
+                    continue
+                selector.register(client, selectors.EVENT_READ, ("request", None))
+
+            elif kind == "request":
+                selector.unregister(sock)
+                try:
+                    request = sock.recv(PIPE_BUF).decode()
+                    socket_path, _, port = request.strip().partition("\t")
+                except (OSError, UnicodeDecodeError):
                     sock.close()
-                    sys.exit(1)
-
-                buffer_handshake.extend(data)
-                match_response = pattern_response.match(buffer_handshake)
-                if match_response:
-                    # Valid handshake reply
-                    completed_handshake = True
-                    # Cut the buffer right after the newline character
-                    stow = buffer_handshake[match_response.end() :]
+                    continue
+                if not (socket_path and port):
+                    refuse(sock)
+                    continue
+
+                key = (socket_path, port)
+                while ready[key]:
+                    session = ready[key].popleft()
+                    hangups.unregister(session)
+                    del idle[session.fileno()]
+                    if is_closed(session):
+                        session.close()
+                        continue
+                    hand_over(sock, session, key)
+                    break
+                else:
+                    waiting[key].append(sock)
+                    refill(key)
+
+            elif kind == "handshake":
+                try:
+                    handshake = receive_handshake(sock)
+                except OSError:
+                    handshake = False
+                if handshake is None:
+                    continue
+
+                selector.unregister(sock)
+                handshaking[key].discard(sock)
+                if not handshake:
+                    sock.close()
+                    if not handshaking[key]:
+                        while waiting[key]:
+                            refuse(waiting[key].popleft())
+                    continue
+
+                if waiting[key]:
+                    hand_over(waiting[key].popleft(), sock, key)
+                else:
+                    ready[key].append(sock)
+                    idle[sock.fileno()] = (sock, key)
+                    hangups.register(sock, select.EPOLLRDHUP)
+
+            elif kind == "hangup":
+                for fd, _ in hangups.poll(0):
+                    # Guest closed the idle connection (eg sshd LoginGraceTime), evict and replace
+                    session, key = idle.pop(fd)
+                    hangups.unregister(session)
+                    ready[key].remove(session)
+                    session.close()
+                    refill(key)
+
+
+def proxy(sock, trace=None):
+    """
+    Shuttle data between stdin/stdout and the handshaked connection, until either side closes.
+    """
+    with trace or nullcontext():
+        proxy_loop(sock, trace)
+
+
+def proxy_loop(sock, trace):
+    sock.setblocking(False)
+
+    # Set stdin to non-blocking mode
+    fd_stdin = sys.stdin.fileno()
+    flags = fcntl.fcntl(fd_stdin, fcntl.F_GETFL)  # Get current flags
+    fcntl.fcntl(fd_stdin, fcntl.F_SETFL, flags | os.O_NONBLOCK)  # Set non-blocking
+
+    # Setup evented I/O and proxy
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    selector.register(fd_stdin, selectors.EVENT_READ)
+    while True:
+        for key, _ in selector.select():
+            if key.fileobj == sock:
+                try:
+                    data = sock.recv(PIPE_BUF)
+                    if not data:
+                        # EOF AF_UNIX
+                        sock.close()
+                        sys.exit(0)
+
+                    if trace:
+                        trace.record(DIRECTION_FROM_SERVICE, data)
+
                     # NOTE; We're reading in non-blocking, so pushing data out
                     # into stdout must be followed by a flush
-                    sys.stdout.buffer.write(stow)
+                    sys.stdout.buffer.write(data)
                     sys.stdout.flush()
-                    break
-            except BlockingIOError:
-                # Assumes attempt at retrieving empty data buffer
-                continue
+                except BlockingIOError:
+                    # Assumes attempt at retrieving empty data buffer
+                    continue
 
-# Handshake is done, proxy as normal
-selector.register(fd_stdin, selectors.EVENT_READ)
-while True:
-    for key, _ in selector.select():
-        if key.fileobj == sock:
-            try:
-                data = sock.recv(PIPE_BUF)
-                if not data:
-                    # EOF AF_UNIX
-                    sock.close()
-                    sys.exit(0)
+            elif key.fileobj == fd_stdin:
+                try:
+                    # Read non-blocking data from stdin
+                    input_data = os.read(fd_stdin, PIPE_BUF)
+                    if not input_data:
+                        # EOF stdin
+                        sock.close()  # Close AF_UNIX connection
+                        sys.exit(0)
 
-                # NOTE; We're reading in non-blocking, so pushing data out
-                # into stdout must be followed by a flush
-                sys.stdout.buffer.write(data)
-                sys.stdout.flush()
-            except BlockingIOError:
-                # Assumes attempt at retrieving empty data buffer
-                continue
+                    if trace:
+                        trace.record(DIRECTION_TO_SERVICE, input_data)
 
-        elif key.fileobj == fd_stdin:
-            try:
-                # Read non-blocking data from stdin
-                input_data = os.read(fd_stdin, PIPE_BUF)
-                if not input_data:
-                    # EOF stdin
-                    sock.close()  # Close AF_UNIX connection
-                    sys.exit(0)
-
-                # Send input data to the socket
-                sock.sendall(input_data)
-            except BlockingIOError:
-                # Assumes attempt at retrieving empty data buffer
-                continue
+                    # Send input data to the socket
+                    sock.sendall(input_data)
+                except BlockingIOError:
+                    # Assumes attempt at retrieving empty data buffer
+                    continue
+
+
+if args.pool_daemon:
+    pool_daemon(args.pool_daemon, args.pool_size)
+    sys.exit(0)
+
+sock = None
+if args.pool:
+    sock = connect_pool(args.pool, SOCKET_PATH, PORT)
+if sock is None:
+    sock = connect_direct(SOCKET_PATH, PORT)
+if sock is None:
+    # Handshake failed
+    sys.exit(1)
+
+# Handshake is done, proxy as normal
+proxy(sock, TraceWriter(args.capture, args.capture_payload) if args.capture else None)
@@ -1,20 +1,18 @@
+# NOTE; This file is imported for every invocation, including "invoke --list" and "invoke --complete". Only import
+# modules here that invoke already loaded itself, import everything else inside the function that uses it.
+# SEEALSO; completion()
 import os
+import sys
+import time
 from pathlib import Path
-from typing import Any, Union
+from typing import Any
 import subprocess
-import getpass
-from tempfile import TemporaryDirectory
 import json
 import warnings
-import platform
 from contextlib import contextmanager, nullcontext
 
 # REF; https://www.pyinvoke.org/
-from invoke import task
-
-# REF; https://github.com/numtide/deploykit/
-# REF; https://github.com/takluyver/pyxdg/
-from xdg.BaseDirectory import save_cache_path
+from invoke import Task, task as invoke_task
 
 
 INVOKED_PATH = Path.cwd()
@@ -22,7 +20,14 @@ INVOKED_PATH = Path.cwd()
 PROJECT_DIR = Path(__file__).parent.resolve()
 os.chdir(PROJECT_DIR)
 
-CACHE_DIR = save_cache_path("proesmans")
+# NOTE; Same location as xdg.BaseDirectory.save_cache_path("proesmans"), without importing pyxdg at startup.
+# REF; https://github.com/takluyver/pyxdg/
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "proesmans"
+)
+os.makedirs(CACHE_DIR, exist_ok=True)
+# Precomputed candidates for shell completion, one directory per kind with one candidate per line.
+COMPLETION_CACHE = Path(CACHE_DIR) / "completion"
 
 FLAKE = PROJECT_DIR / "flake"
 DOCS = PROJECT_DIR / "documentation"
@@ -37,13 +42,148 @@ LOCAL_TARGETS_MARKER = ["localhost", "127.0.0.1", "192.168.", ".internal.proesma
 # WARN; Path hardcoded in DISKO configuration !
 REMOTE_LUKS_SECRET_PATH = "/tmp/deployment-disk.key"
 
+# WARN; Port in priviledged range, must be the same as defined in nixosModules/profiles/remote-machine/initrd-ssh.nix!
+INITRD_SSH_PORT = 23
+
+# NOTE; Every nix evaluation of a host configuration takes a lot of memory (think GiB's), limit the amount of
+# concurrent evaluations.
+MAX_PARALLEL_EVALUATIONS = 4
+
+# System closures of deployed hosts are pinned (protected from garbage collection) for instant rollbacks.
+# The newest generations per host are always kept, older generations are evicted least-recently-used first when
+# all pinned closures together take more space than the budget.
+# SEEALSO; pins()
+PIN_STORE = Path(CACHE_DIR) / "pins"
+PIN_GENERATIONS = 3
+PIN_BUDGET = "30G"
+
+# Services declared in the facts inventory (service.<name>.port/uri) are probed after activation, each attempt
+# must finish within the timeout (seconds).
+# SEEALSO; probe()
+PROBE_TIMEOUT = 3
+PROBE_ATTEMPTS = 3
+PROBE_INTERVAL = 1
+
+# Metrics of each host configuration, recorded by task 'ci' per commit. A host regresses when its closure size or
+# evaluation time grows more than the threshold (percent) compared to the previous commit. Evaluation time
+# differences below the noise floor (seconds) are ignored.
+# SEEALSO; ci()
+CI_METRICS = Path(CACHE_DIR) / "ci-metrics.jsonl"
+CI_HISTORY = 500
+CI_CLOSURE_THRESHOLD = 10
+CI_EVAL_THRESHOLD = 50
+CI_EVAL_NOISE = 2.0
+
+# Builders are taken from the nix.buildMachines option of this host configuration, aka the configuration of the
+# development machine that executes these tasks.
+# SEEALSO; nixosConfigurations/freddy/remote-builder.nix
+BUILDERS_SOURCE_HOST = "development"
+
+# Runtime behaviour, changed by task 'batch'.
+# Emit newline-delimited JSON events instead of free text
+OUTPUT_JSON = False
+# Answer all confirmations with "yes"
+ASSUME_YES = False
+# Stream that receives the JSON events, this is the original stdout of the process.
+# SEEALSO; batch()
+EVENT_STREAM = sys.stdout
+
 
 def alert_finish():
     # Riiiing my bell ! Ring my bell ! TINGELINGELING
     print("\a")
 
 
+def report(message: str | None, event: str = "message", **fields: Any) -> None:
+    """
+    Print the message for humans, or emit a structured event in JSON mode.
+    Messages without text are only emitted in JSON mode.
+    """
+    if OUTPUT_JSON:
+        record = {"event": event, "time": time.time(), **fields}
+        if message:
+            record["message"] = message
+        EVENT_STREAM.write(json.dumps(record, default=str) + "\n")
+        EVENT_STREAM.flush()
+    elif message:
+        print(message)
+
+
+@contextmanager
+def phase(name: str, message: str | None = None, **fields: Any):
+    """
+    Report the start, end and duration (seconds) of a unit of work. Failures are reported before propagating.
+    """
+    report(message, event="phase-start", phase=name, **fields)
+    start = time.monotonic()
+    try:
+        yield
+    except BaseException as e:
+        report(
+            None,
+            event="error",
+            phase=name,
+            duration=time.monotonic() - start,
+            error=str(e) or type(e).__name__,
+            type=type(e).__name__,
+            **fields,
+        )
+        raise
+    report(
+        None,
+        event="phase-end",
+        phase=name,
+        duration=time.monotonic() - start,
+        **fields,
+    )
+
+
+class ReportedTask(Task):
+    """
+    Invoke task that reports its execution as phase.
+    """
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        with phase(self.name, task=self.name):
+            return super().__call__(*args, **kwargs)
+
+
+def task(*args: Any, **kwargs: Any) -> Any:
+    return invoke_task(*args, klass=ReportedTask, **kwargs)
+
+
+class FlagNamesTask(Task):
+    """
+    Invoke task with explicit command line flag names for some parameters, eg when the parameter name would shadow
+    a module.
+    """
+
+    def __init__(self, *args: Any, flags: dict[str, str] | None = None, **kwargs: Any):
+        self.flags = flags or {}
+        super().__init__(*args, **kwargs)
+
+    def arg_opts(
+        self, name: str, default: str, taken_names: set[str]
+    ) -> dict[str, Any]:
+        opts = super().arg_opts(name, default, taken_names)
+        if name in self.flags:
+            opts.pop("attr_name", None)
+            opts["names"] = [self.flags[name], *opts["names"][1:]]
+        return opts
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        parameters = {flag: name for name, flag in self.flags.items()}
+        return super().__call__(
+            *args, **{parameters.get(k, k): v for k, v in kwargs.items()}
+        )
+
+
 def ask_user_input(message: str) -> bool:
+    if ASSUME_YES or OUTPUT_JSON:
+        # NOTE; Non-interactive mode declines everything that isn't explicitly allowed with --yes
+        report(None, event="confirmation", question=message, answer=ASSUME_YES)
+        return ASSUME_YES
+
     user_reply = input(f"{message} [y/N]: ")
     return user_reply in ["yes", "y"]
 
@@ -71,38 +211,865 @@ def find_string_in_file(file_path, needle):
         raise
 
 
-def private_opener(path: str, flags: int) -> Union[str, int]:
-    return os.open(path, flags, 0o400)
+def private_opener(path: str, flags: int) -> int:
+    return os.open(path, flags, 0o400)
+
+
+def dev_key_decrypt() -> str:
+    assert DEV_KEY.exists(), """
+        The encrypted development key is not found next to the tasks.py file!
+    """
+
+    warnings.warn("Decrypting the development key for usage!")
+    age_key = subprocess.run(
+        ["rage", "--decrypt", DEV_KEY.as_posix()],
+        text=True,  # stdin/stdout are opened in text mode
+        check=True,  # Throw exception if command fails
+        capture_output=True,  # Redirect stdout/stderr
+    ).stdout.strip()
+
+    assert age_key, """
+        Expected to decrypt an AGE private key, but decrypted an empty string. Something went unexpectedly wrong!
+    """
+
+    return age_key
+
+
+def get_verified_password() -> str:
+    import getpass
+
+    if OUTPUT_JSON:
+        # Non-interactive mode, the password is provided as single line on stdin
+        password = sys.stdin.readline().rstrip("\n")
+        if not password:
+            raise ValueError("Expected a password on stdin, but received an empty line")
+        return password
+
+    while True:
+        first = getpass.getpass("Enter password: ")
+        second = getpass.getpass("Confirm password: ")
+        if first == second:
+            return first
+        else:
+            print("Passwords do not match. Try again.")
+
+
+def host_names() -> list[str]:
+    """
+    Names of all host configurations, based on the directory listing of {FLAKE}/nixosConfigurations.
+    """
+    configurations_dir = FLAKE / "nixosConfigurations"
+    return sorted(
+        entry.name
+        for entry in configurations_dir.iterdir()
+        if entry.name != "archive" and (entry / "configuration.nix").is_file()
+    )
+
+
+def remote_hosts(facts: dict[str, dict[str, Any]]) -> list[str]:
+    """
+    Hosts that are managed over ssh, aka all hosts except this machine. The development machine is rebuilt locally
+    with task 'dev-rebuild'.
+    """
+    import platform
+
+    return [x for x in facts if x not in ("development", platform.node())]
+
+
+def host_facts() -> dict[str, dict[str, Any]]:
+    """
+    Evaluate connection string, disk encryption flag and services of all hosts from the facts inventory.
+    The service URI is applied to the connection string.
+    """
+    text_machines = subprocess.run(
+        [
+            "nix",
+            "eval",
+            "--json",
+            f"{FLAKE}#facts",
+            "--apply",
+            # ERROR; The evalModule system asserts when accessing a config value for unset option.
+            # ERROR; The to-JSON export function asserts when it encounters a function.
+            # TODO; Use host-data before fallback to dns-name.
+            """
+            builtins.mapAttrs (_: v: let connection = "${v.hostName}.${v.domainName}"; in {
+                inherit connection;
+                inherit (v) encryptedDisks;
+                service = builtins.mapAttrs (_: s: {
+                    inherit (s) port;
+                    uri = if s.uri == null then null else s.uri connection;
+                }) v.service;
+            })
+            """,
+        ],
+        check=True,
+        text=True,
+        capture_output=True,
+    ).stdout.strip()
+    facts = json.loads(text_machines)
+    # NOTE; Evaluating facts is too slow for tab completion, keep the result for later completions
+    completion_cache_write("connections", [v["connection"] for v in facts.values()])
+    return facts
+
+
+def host_secret_files(hostname: str) -> list[Path]:
+    """
+    All sops encrypted files of the provided host configuration.
+    """
+    return sorted(
+        x
+        for x in (FLAKE / "nixosConfigurations" / hostname).iterdir()
+        if x.name.endswith((".encrypted.yaml", ".encrypted.json"))
+    )
+
+
+def secret_file_keys(file_path: Path) -> list[str]:
+    """
+    Top-level key names inside the sops encrypted file. Sops only encrypts the values, these names are plaintext.
+    """
+    text = file_path.read_text()
+    # NOTE; Files encrypted in binary mode are always stored as JSON, whatever the file extension
+    if text.startswith("{"):
+        try:
+            keys = list(json.loads(text))
+        except ValueError:
+            return []
+    else:
+        keys = [
+            line.partition(":")[0]
+            for line in text.splitlines()
+            if line[:1] not in ("", " ", "#", "-") and ":" in line
+        ]
+    return [x for x in keys if x != "sops"]
+
+
+def completion_cache_write(kind: str, candidates: list[str]) -> None:
+    path = COMPLETION_CACHE / kind
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # NOTE; Replace atomically, the completion script could be reading concurrently
+    temporary_path = path.with_name(f".{path.name}.{os.getpid()}")
+    temporary_path.write_text("".join(f"{x}\n" for x in candidates))
+    temporary_path.replace(path)
+
+
+def completion_cache_update(force: bool = False) -> None:
+    """
+    Precompute host names, secret file names and secret key names for shell completion.
+
+    The directory listing of {FLAKE}/nixosConfigurations is the source, change detection is based on the
+    modification times of the listed directories and secret files (cheap enough to execute on every import).
+    """
+    configurations_dir = FLAKE / "nixosConfigurations"
+    marker_file = COMPLETION_CACHE / "marker"
+    try:
+        secret_files = {
+            hostname: host_secret_files(hostname) for hostname in host_names()
+        }
+        marker = " ".join(
+            str(x.stat().st_mtime_ns)
+            for x in [
+                # NOTE; Detects added or removed tasks
+                Path(__file__),
+                configurations_dir,
+                *(configurations_dir / x for x in secret_files),
+                *(x for files in secret_files.values() for x in files),
+            ]
+        )
+    except OSError:
+        # Completion is best effort, never fail the actual task
+        return
+
+    if not force and marker_file.is_file() and marker_file.read_text() == marker:
+        return
+
+    import shutil
+
+    # Drop candidates of removed hosts and files
+    shutil.rmtree(COMPLETION_CACHE / "files", ignore_errors=True)
+    shutil.rmtree(COMPLETION_CACHE / "keys", ignore_errors=True)
+    completion_cache_write("hosts", list(secret_files))
+    for hostname, files in secret_files.items():
+        completion_cache_write(f"files/{hostname}", [x.name for x in files])
+        for file_path in files:
+            completion_cache_write(
+                f"keys/{hostname}/{file_path.name}", secret_file_keys(file_path)
+            )
+    completion_cache_write(
+        "tasks",
+        sorted(
+            value.name.replace("_", "-")
+            for value in globals().values()
+            if isinstance(value, Task)
+        ),
+    )
+    marker_file.write_text(marker)
+
+
+def build_inventory(hosts: list[str]) -> dict[str, Any]:
+    """
+    Evaluate the platform of each provided host and the remote builders (nix.buildMachines) of the development
+    machine. Results are cached until any file of the flake changes.
+    """
+    import hashlib
+
+    cache_file = Path(CACHE_DIR) / "build-inventory.json"
+    fingerprint = hashlib.sha256(
+        json.dumps([sorted(hosts), sorted(snapshot_tree(FLAKE).items())]).encode()
+    ).hexdigest()
+    if cache_file.is_file():
+        cached = json.loads(cache_file.read_text())
+        if cached.get("fingerprint") == fingerprint:
+            return cached
+
+    inventory = json.loads(
+        subprocess.run(
+            [
+                "nix",
+                "eval",
+                "--json",
+                f"{FLAKE}#nixosConfigurations",
+                "--apply",
+                f"""configurations: {{
+                    platforms = builtins.mapAttrs (_: v: v.config.nixpkgs.hostPlatform.system)
+                        (builtins.intersectAttrs (builtins.fromJSON ''{json.dumps({x: True for x in hosts})}'') configurations);
+                    builders = map
+                        (m: {{ inherit (m) hostName protocol sshUser sshKey systems maxJobs speedFactor supportedFeatures mandatoryFeatures publicHostKey; }})
+                        configurations.{BUILDERS_SOURCE_HOST}.config.nix.buildMachines;
+                }}""",
+            ],
+            check=True,
+            text=True,
+            capture_output=True,
+        ).stdout
+    )
+    inventory["fingerprint"] = fingerprint
+    cache_file.write_text(json.dumps(inventory))
+    return inventory
+
+
+def builder_specification(builder: dict[str, Any]) -> str:
+    """
+    Remote builder as line of the nix machines format.
+    REF; https://nix.dev/manual/nix/latest/command-ref/conf-file.html#conf-builders
+    """
+    return " ".join(
+        [
+            f"{builder['protocol'] or 'ssh'}://{builder['sshUser'] + '@' if builder['sshUser'] else ''}{builder['hostName']}",
+            ",".join(builder["systems"]),
+            builder["sshKey"] or "-",
+            str(builder["maxJobs"]),
+            str(builder["speedFactor"]),
+            ",".join(builder["supportedFeatures"]) or "-",
+            ",".join(builder["mandatoryFeatures"]) or "-",
+            builder["publicHostKey"] or "-",
+        ]
+    )
+
+
+def builder_load(builder: dict[str, Any] | None) -> float | None:
+    """
+    Load average of the last minute per CPU of the builder, this machine if no builder is provided.
+    None if the builder is unreachable.
+    """
+    if builder is None:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+    result = subprocess.run(
+        [
+            "ssh",
+            "-o",
+            "BatchMode=yes",
+            "-o",
+            "ConnectTimeout=5",
+            f"{builder['sshUser'] + '@' if builder['sshUser'] else ''}{builder['hostName']}",
+            "cat /proc/loadavg; nproc",
+        ],
+        text=True,
+        capture_output=True,
+        check=False,  # Unreachable is a result
+    )
+    values = result.stdout.split()
+    if result.returncode != 0 or len(values) < 6:
+        return None
+    return float(values[0]) / max(int(values[-1]), 1)
+
+
+def build_placement(hosts: list[str]) -> dict[str, dict[str, Any]]:
+    """
+    Pick a native builder for the system closure of each host; this machine or a remote builder with the same
+    platform, whichever is least loaded. Remote builders are preferred over emulation, and builders that cannot be
+    reached are only used as last resort.
+
+    Returns per host the system, builder name (None without native builder) and the NIX_CONFIG to build with.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    inventory = build_inventory(hosts)
+    local_system = f"{os.uname().machine}-linux"
+    # NOTE; None is this machine
+    machines: list[dict[str, Any] | None] = [None, *inventory["builders"]]
+
+    def supports(machine: dict[str, Any] | None, system: str) -> bool:
+        return (
+            system == local_system if machine is None else system in machine["systems"]
+        )
+
+    native = {
+        hostname: [
+            index
+            for index, machine in enumerate(machines)
+            if supports(machine, inventory["platforms"][hostname])
+        ]
+        for hostname in hosts
+    }
+    # NOTE; Load is only measured when there is a choice, every measurement of a remote builder is an ssh session
+    measured = sorted(
+        {x for indices in native.values() if len(indices) > 1 for x in indices}
+    )
+    loads: dict[int, float | None] = {}
+    if measured:
+        with ThreadPoolExecutor(max_workers=len(measured)) as executor:
+            loads = dict(
+                zip(
+                    measured,
+                    executor.map(builder_load, [machines[x] for x in measured]),
+                )
+            )
+
+    placement = {}
+    for hostname in hosts:
+        system = inventory["platforms"][hostname]
+        candidates = []
+        for index in native[hostname]:
+            machine = machines[index]
+            if machine is None:
+                candidates.append(("local", loads.get(index), "builders ="))
+                continue
+            candidates.append(
+                (
+                    machine["hostName"],
+                    loads.get(index),
+                    # NOTE; Zero local jobs forces all builds onto the remote builder
+                    f"builders = {builder_specification(machine)}\nmax-jobs = 0",
+                )
+            )
+        # Lowest load first, unknown load last
+        candidates.sort(key=lambda x: (x[1] is None, x[1] or 0.0))
+
+        builder_name, load, nix_config = (
+            candidates[0] if candidates else (None, None, "")
+        )
+        placement[hostname] = {
+            "system": system,
+            "builder": builder_name,
+            "nix_config": nix_config,
+        }
+        report(
+            f"Building {hostname} ({system}) on {builder_name or 'the target itself, no native builder'}",
+            event="placement",
+            host=hostname,
+            system=system,
+            builder=builder_name,
+            load=load,
+        )
+    return placement
+
+
+def placement_environment(placement: dict[str, Any]) -> dict[str, str]:
+    environment = os.environ.copy()
+    if placement["nix_config"]:
+        environment["NIX_CONFIG"] = "\n".join(
+            x for x in [environment.get("NIX_CONFIG", ""), placement["nix_config"]] if x
+        )
+    return environment
+
+
+def host_toplevel_path(hostname: str) -> str:
+    """
+    Evaluate (without building) the output path of the system closure of the provided host.
+    """
+    return subprocess.run(
+        [
+            "nix",
+            "eval",
+            "--raw",
+            f"{FLAKE}#nixosConfigurations.{hostname}.config.system.build.toplevel.outPath",
+        ],
+        check=True,
+        text=True,
+        capture_output=True,
+    ).stdout.strip()
+
+
+def snapshot_tree(*directories: Path) -> dict[str, tuple[int, int]]:
+    """
+    Cheap change marker of all files inside the provided directories, without reading file contents.
+    """
+    snapshot = {}
+    for directory in directories:
+        for file_path in directory.rglob("*"):
+            if ".git" in file_path.parts or not file_path.is_file():
+                continue
+            stat = file_path.stat()
+            snapshot[file_path.as_posix()] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def host_closure(hostname: str) -> list[str] | None:
+    """
+    All store paths of the locally realised system closure of the provided host, or None if not realised.
+    """
+    result = subprocess.run(
+        [
+            "nix",
+            "path-info",
+            "--recursive",
+            f"{FLAKE}#nixosConfigurations.{hostname}.config.system.build.toplevel",
+        ],
+        check=False,  # Unrealised paths are not an error
+        text=True,
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        return None
+    return result.stdout.split()
+
+
+def parse_size(text: str) -> int:
+    """
+    Amount of bytes from a human readable size, eg "512M" or "30GiB".
+    """
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    text = text.strip().upper().removesuffix("B").removesuffix("I")
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def format_size(size: int) -> str:
+    if size < 1024:
+        return f"{size} B"
+    value = float(size)
+    for unit in ["KiB", "MiB", "GiB"]:
+        value /= 1024
+        if value < 1024:
+            return f"{value:.1f} {unit}"
+    return f"{value / 1024:.1f} TiB"
+
+
+def host_pins(hostname: str) -> list[Path]:
+    """
+    Garbage collector roots of the system closures of the host, most recently used first.
+    """
+    directory = PIN_STORE / hostname
+    if not directory.is_dir():
+        return []
+    return sorted(
+        (x for x in directory.iterdir() if x.is_symlink()),
+        key=lambda x: x.lstat().st_mtime,
+        reverse=True,
+    )
+
+
+def pinned_hosts() -> list[str]:
+    pins_migrate_legacy()
+    if not PIN_STORE.is_dir():
+        return []
+    return sorted(x.name for x in PIN_STORE.iterdir() if x.is_dir())
+
+
+def pin_closure(hostname: str, store_path: str) -> Path:
+    """
+    Protect the (locally realised) system closure from garbage collection, as most recent generation of the host.
+    """
+    pin = PIN_STORE / hostname / Path(store_path).name
+    pin.parent.mkdir(parents=True, exist_ok=True)
+    subprocess.run(
+        ["nix-store", "--add-root", pin.as_posix(), "--realise", store_path],
+        check=True,
+    )
+    if pin.is_symlink():
+        # NOTE; Re-pinning an existing generation must mark it as recently used
+        os.utime(pin, follow_symlinks=False)
+    return pin
+
+
+def pins_rollback(hostname: str, failed: str, restored: str) -> None:
+    """
+    Mark the restored generation of the host as most recently used, and the failed generation as least recently used
+    so it's the first to be evicted.
+    """
+    restored_pin = PIN_STORE / hostname / Path(restored).name
+    if restored_pin.is_symlink():
+        os.utime(restored_pin, follow_symlinks=False)
+    failed_pin = PIN_STORE / hostname / Path(failed).name
+    if failed_pin.is_symlink():
+        os.utime(failed_pin, times=(0, 0), follow_symlinks=False)
+
+
+def pins_migrate_legacy() -> None:
+    """
+    Move the single pin per host, from before the pin store existed, into the pin store.
+    """
+    for legacy_pin in Path(CACHE_DIR).glob("*.pin"):
+        if legacy_pin.is_symlink() and Path(os.readlink(legacy_pin)).exists():
+            pin_closure(legacy_pin.name.removesuffix(".pin"), os.readlink(legacy_pin))
+        legacy_pin.unlink()
+
+
+def running_systems(hostname: str) -> set[str]:
+    """
+    System closures last known to be running (or booting next) on the host.
+    """
+    running_file = PIN_STORE / hostname / "running"
+    if not running_file.is_file():
+        return set()
+    return set(running_file.read_text().split())
+
+
+def record_running_systems(hostname: str, store_paths: set[str]) -> None:
+    running_file = PIN_STORE / hostname / "running"
+    running_file.parent.mkdir(parents=True, exist_ok=True)
+    running_file.write_text("".join(f"{x}\n" for x in sorted(store_paths)))
+
+
+def system_links(ssh_connection_string: str | None) -> dict[str, str] | None:
+    """
+    Store paths of the active ("current"), booted ("booted") and next boot ("profile") system of the host, with one
+    ssh session. Without connection string the links of this machine are read. None if the host is unreachable.
+    """
+    links = [
+        "/run/current-system",
+        "/run/booted-system",
+        "/nix/var/nix/profiles/system",
+    ]
+    if ssh_connection_string is None:
+        return dict(zip(["current", "booted", "profile"], map(os.path.realpath, links)))
+
+    result = subprocess.run(
+        [
+            "ssh",
+            "-o",
+            "BatchMode=yes",
+            "-o",
+            "ConnectTimeout=10",
+            ssh_connection_string,
+            f"readlink -f {' '.join(links)}",
+        ],
+        text=True,
+        capture_output=True,
+        check=False,  # Unreachable is a result
+    )
+    paths = result.stdout.split()
+    if result.returncode != 0 or len(paths) != len(links):
+        return None
+    return dict(zip(["current", "booted", "profile"], paths))
+
+
+def probe_running_systems(ssh_connection_string: str) -> set[str] | None:
+    """
+    System closures that are active, booted, or will be booted on the host. None if the host is unreachable.
+    """
+    links = system_links(ssh_connection_string)
+    return set(links.values()) if links is not None else None
+
+
+async def probe_connection(uri: str, port: int | None) -> None:
+    """
+    Connect to the service, raises on failure. HTTP(S) services must answer a GET request without server error, all
+    other services must accept the TCP connection.
+    """
+    import asyncio
+    import ssl
+    from urllib.parse import urlsplit
+
+    parts = urlsplit(uri)
+    port = parts.port or port or {"https": 443, "http": 80}.get(parts.scheme)
+    if not parts.hostname or not port:
+        raise ValueError(f"No address to probe in {uri}")
+
+    context = None
+    if parts.scheme == "https":
+        # NOTE; Certificates of internal services don't validate from everywhere, this probes availability only
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+    reader, writer = await asyncio.open_connection(parts.hostname, port, ssl=context)
+    try:
+        if parts.scheme in ("http", "https"):
+            writer.write(
+                f"GET {parts.path or '/'} HTTP/1.1\r\nHost: {parts.hostname}\r\nConnection: close\r\n\r\n".encode()
+            )
+            await writer.drain()
+            status_line = (await reader.readline()).split()
+            if len(status_line) < 2 or not status_line[0].startswith(b"HTTP/"):
+                raise ValueError("No HTTP response")
+            if int(status_line[1]) >= 500:
+                raise ValueError(f"HTTP status {int(status_line[1])}")
+    finally:
+        writer.close()
+
+
+async def probe_service(
+    uri: str, port: int | None, timeout: float, attempts: int, interval: float
+) -> str | None:
+    """
+    Returns None if the service is healthy within the amount of attempts, otherwise the last failure.
+    """
+    import asyncio
+
+    error = None
+    for attempt in range(attempts):
+        if attempt:
+            await asyncio.sleep(interval)
+        try:
+            await asyncio.wait_for(probe_connection(uri, port), timeout)
+            return None
+        except (OSError, ValueError, TimeoutError) as e:
+            error = str(e) or type(e).__name__
+    return error
+
+
+def probe_hosts(
+    facts: dict[str, dict[str, Any]],
+    hosts: list[str],
+    timeout: float = PROBE_TIMEOUT,
+    attempts: int = PROBE_ATTEMPTS,
+    interval: float = PROBE_INTERVAL,
+) -> dict[tuple[str, str], str | None]:
+    """
+    Probe all services of the provided hosts concurrently. Returns per (host, service) None if healthy, otherwise
+    the failure.
+    """
+    import asyncio
+
+    services = [
+        (
+            hostname,
+            name,
+            service.get("uri") or f"tcp://{facts[hostname]['connection']}",
+            service.get("port"),
+        )
+        for hostname in hosts
+        for name, service in facts.get(hostname, {}).get("service", {}).items()
+    ]
+    if not services:
+        return {}
+
+    async def probe_all() -> list[str | None]:
+        return await asyncio.gather(
+            *(
+                probe_service(uri, port, timeout, attempts, interval)
+                for _, _, uri, port in services
+            )
+        )
+
+    results = {}
+    for (hostname, name, uri, _), error in zip(services, asyncio.run(probe_all())):
+        results[(hostname, name)] = error
+        report(None, event="probe", host=hostname, service=name, uri=uri, error=error)
+    return results
+
+
+def rollback_host(ssh_connection_string: str, store_path: str) -> None:
+    """
+    Activate the provided, previously deployed, system closure on the host without evaluating or building anything.
+    """
+    subprocess.run(
+        [
+            "nix",
+            "copy",
+            "--to",
+            f"ssh-ng://{ssh_connection_string}",
+            "--substitute-on-destination",
+            store_path,
+        ],
+        check=True,
+    )
+    # NOTE; Same steps as nixos-rebuild switch after building
+    subprocess.run(
+        [
+            "ssh",
+            ssh_connection_string,
+            (
+                f"sudo nix-env --profile /nix/var/nix/profiles/system --set {store_path}"
+                f" && sudo {store_path}/bin/switch-to-configuration switch"
+            ),
+        ],
+        check=True,
+    )
+
+
+def activation_is_noop(
+    store_path: str, links: dict[str, str] | None, boot: bool
+) -> bool:
+    """
+    True if activating the system closure wouldn't change the host; it's already active (switch) or the next boot
+    entry (boot).
+    """
+    if links is None:
+        return False
+    if boot:
+        return links["profile"] == store_path
+    return links["current"] == store_path and links["profile"] == store_path
+
+
+def store_path_info(store_paths: list[str]) -> dict[str, dict[str, Any]]:
+    """
+    NAR size, closure size and references of the provided paths and everything inside their closures.
+    """
+    result = subprocess.run(
+        ["nix", "path-info", "--json", "--recursive", "--closure-size", *store_paths],
+        check=True,
+        text=True,
+        capture_output=True,
+    )
+    info = json.loads(result.stdout or "{}")
+    # NOTE; Older nix versions output a list of objects, newer versions a mapping keyed by store path
+    if isinstance(info, list):
+        info = {x["path"]: x for x in info}
+    return {path: x for path, x in info.items() if x}
+
+
+def closure_paths(store_path: str, info: dict[str, dict[str, Any]]) -> set[str]:
+    closure = set()
+    stack = [store_path]
+    while stack:
+        path = stack.pop()
+        if path in closure or path not in info:
+            continue
+        closure.add(path)
+        stack.extend(info[path].get("references", []))
+    return closure
+
+
+def pins_prune(
+    keep: int, budget: int, dry_run: bool = False, hosts: list[str] | None = None
+) -> tuple[list[Path], int]:
+    """
+    Evict least recently used pins until all pinned closures together fit inside the budget (bytes).
+    The newest <keep> pins of each host, and the closures running on a host, are never evicted. Only pins of the
+    provided hosts are evicted, if any, the budget still counts the pins of all hosts.
+    Returns the evicted pins and the store size of the remaining pinned closures.
+    """
+    pins = {hostname: host_pins(hostname) for hostname in pinned_hosts()}
+    targets = {pin: os.readlink(pin) for x in pins.values() for pin in x}
+    if not targets:
+        return [], 0
+
+    info = store_path_info(sorted(set(targets.values())))
+    closures = {x: closure_paths(x, info) for x in set(targets.values())}
+
+    def store_size(remaining: list[Path]) -> int:
+        # NOTE; Closures share most of their paths, count each path once
+        paths = set().union(*(closures[targets[x]] for x in remaining))
+        return sum(info[x].get("narSize", 0) for x in paths)
+
+    protected = set()
+    for hostname, host_pinned in pins.items():
+        if hosts is not None and hostname not in hosts:
+            protected.update(host_pinned)
+            continue
+        running = running_systems(hostname)
+        protected.update(host_pinned[:keep])
+        protected.update(x for x in host_pinned if targets[x] in running)
+
+    remaining = list(targets)
+    evicted = []
+    for pin in sorted(
+        (x for x in targets if x not in protected), key=lambda x: x.lstat().st_mtime
+    ):
+        if store_size(remaining) <= budget:
+            break
+        remaining.remove(pin)
+        evicted.append(pin)
+
+    if not dry_run:
+        for pin in evicted:
+            # NOTE; Nix drops the dangling garbage collector root during the next garbage collection
+            pin.unlink()
+    return evicted, store_size(remaining)
 
 
-def dev_key_decrypt() -> str:
-    assert DEV_KEY.exists(), """
-        The encrypted development key is not found next to the tasks.py file!
+def binary_cache_url(store_url: str) -> str:
     """
+    Add transfer options to the store URL, unless the URL already sets them.
+    """
+    if not store_url.startswith(("file://", "s3://")):
+        # NOTE; Remote stores (eg ssh-ng://) receive uncompressed NARs, only ask for compression on the wire
+        if (
+            store_url.startswith(("ssh://", "ssh-ng://"))
+            and "compress=" not in store_url
+        ):
+            return f"{store_url}{'&' if '?' in store_url else '?'}compress=true"
+        return store_url
 
-    warnings.warn("Decrypting the development key for usage!")
-    age_key = subprocess.run(
-        ["rage", "--decrypt", DEV_KEY.as_posix()],
-        text=True,  # stdin/stdout are opened in text mode
-        check=True,  # Throw exception if command fails
-        capture_output=True,  # Redirect stdout/stderr
-    ).stdout.strip()
+    options = {"compression": "zstd", "parallel-compression": "true"}
+    existing = {x.partition("=")[0] for x in store_url.partition("?")[2].split("&")}
+    extra = "&".join(f"{k}={v}" for k, v in options.items() if k not in existing)
+    if not extra:
+        return store_url
+    return f"{store_url}{'&' if '?' in store_url else '?'}{extra}"
 
-    assert age_key, """
-        Expected to decrypt an AGE private key, but decrypted an empty string. Something went unexpectedly wrong!
+
+def cache_push_hosts(store_url: str, hosts: list[str], full: bool = False) -> None:
     """
+    Copy the locally realised closures of the provided hosts into the binary cache.
+    Only paths that were not pushed before are copied, the pushed set is recorded per cache under CACHE_DIR.
+    """
+    import hashlib
+    from concurrent.futures import ThreadPoolExecutor
 
-    return age_key
+    push_cache = Path(CACHE_DIR) / "cache-push"
+    push_cache.mkdir(parents=True, exist_ok=True)
+    cache_id = hashlib.sha256(store_url.encode()).hexdigest()[:16]
+    pushed_file = push_cache / f"{cache_id}.paths"
 
+    pushed: set[str] = set()
+    if pushed_file.is_file() and not full:
+        pushed = set(pushed_file.read_text().split())
 
-def get_verified_password() -> str:
-    while True:
-        first = getpass.getpass("Enter password: ")
-        second = getpass.getpass("Confirm password: ")
-        if first == second:
-            return first
-        else:
-            print("Passwords do not match. Try again.")
+    with (
+        phase("closure", f"== Collecting closures of {len(hosts)} hosts =="),
+        ThreadPoolExecutor(max_workers=MAX_PARALLEL_EVALUATIONS) as executor,
+    ):
+        closures = dict(zip(hosts, executor.map(host_closure, hosts)))
+
+    realised: set[str] = set()
+    for hostname, closure in closures.items():
+        if closure is None:
+            report(
+                f"Host {hostname} is not realised locally, skipping",
+                event="skip",
+                host=hostname,
+            )
+            continue
+        realised.update(closure)
+
+    new_paths = sorted(realised - pushed)
+    if not new_paths:
+        report(f"Binary cache {store_url} is up-to-date", event="cache-push", paths=0)
+        return
+
+    # NOTE; nix copy queries the destination for valid paths and only uploads missing NARs. The binary cache
+    # itself deduplicates by content address (NAR hash).
+    with phase(
+        "push",
+        f"== Pushing {len(new_paths)} new paths to {store_url} ==",
+        store=store_url,
+        paths=len(new_paths),
+    ):
+        subprocess.run(
+            ["nix", "copy", "--to", binary_cache_url(store_url), "--stdin"],
+            input="\n".join(new_paths),
+            text=True,
+            check=True,
+        )
+
+    # Only record after a successful copy
+    pushed_file.with_suffix(".tmp").write_text("\n".join(sorted(pushed | realised)))
+    pushed_file.with_suffix(".tmp").replace(pushed_file)
 
 
 @contextmanager
@@ -117,6 +1084,35 @@ def pipe_with_data(data: bytes):
         os.close(read_descriptor)
 
 
+@invoke_task(
+    klass=FlagNamesTask,
+    flags={"json_output": "json"},
+    help={
+        "json_output": "Emit newline-delimited JSON events on stdout",
+        "yes": "Answer all confirmations with yes",
+    },
+)
+# USAGE; invoke batch --json --yes rebuild development
+def batch(c: Any, json_output: bool = False, yes: bool = False) -> None:
+    """
+    Non-interactive mode for all tasks following this one on the command line.
+
+    --json emits newline-delimited JSON events (phases, durations, store paths, errors) on stdout, output of
+    subprocesses is moved to stderr. --yes answers all confirmations with "yes", otherwise they're declined.
+    Passwords are read as single line from stdin.
+    """
+    global OUTPUT_JSON, ASSUME_YES, EVENT_STREAM
+
+    ASSUME_YES = yes
+    if json_output:
+        OUTPUT_JSON = True
+        # NOTE; Only events are allowed on stdout. Keep a handle to the original stdout for the events, and point
+        # file descriptor 1 to stderr so all other output (including from subprocesses and invoke) ends up there.
+        sys.stdout.flush()
+        EVENT_STREAM = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+
 @task
 # USAGE: invoke check all|<hostName>
 def check(c: Any, hostName: str) -> None:
@@ -134,10 +1130,211 @@ def check(c: Any, hostName: str) -> None:
     alert_finish()
 
 
+def host_metrics(hostname: str) -> dict[str, Any]:
+    """
+    Evaluation time (CPU seconds) of the system closure of the provided host, and closure size (bytes) and amount of
+    paths if the closure is realised locally.
+    """
+    from tempfile import TemporaryDirectory
+
+    with TemporaryDirectory(prefix="eval-stats-") as temporary_directory:
+        stats_file = Path(temporary_directory) / "stats.json"
+        start = time.monotonic()
+        # NOTE; The evaluation cache would turn the measurement into a cache lookup. The derivations are already
+        # written into the store by the CI build, so this only costs the evaluation itself.
+        store_path = subprocess.run(
+            [
+                "nix",
+                "eval",
+                "--no-eval-cache",
+                "--raw",
+                f"{FLAKE}#nixosConfigurations.{hostname}.config.system.build.toplevel.outPath",
+            ],
+            env={
+                **os.environ,
+                "NIX_SHOW_STATS": "1",
+                "NIX_SHOW_STATS_PATH": stats_file.as_posix(),
+            },
+            check=True,
+            text=True,
+            capture_output=True,
+        ).stdout.strip()
+        elapsed = time.monotonic() - start
+        # NOTE; CPU time of the evaluator is barely affected by concurrent evaluations, unlike the wall clock time.
+        # Falls back to the wall clock time when nix doesn't report statistics.
+        # REF; https://nix.dev/manual/nix/stable/command-ref/env-common#env-NIX_SHOW_STATS
+        stats = json.loads(stats_file.read_text()) if stats_file.is_file() else {}
+    metrics: dict[str, Any] = {"eval": round(stats.get("cpuTime", elapsed), 2)}
+
+    # NOTE; Equivalent to "nix path-info -rS", closures skipped by --skip-cached are not realised
+    result = subprocess.run(
+        ["nix", "path-info", "--json", "--recursive", "--closure-size", store_path],
+        check=False,  # Unrealised paths are not an error
+        text=True,
+        capture_output=True,
+    )
+    if result.returncode == 0:
+        info = json.loads(result.stdout or "{}")
+        if isinstance(info, list):
+            info = {x["path"]: x for x in info}
+        if info.get(store_path):
+            metrics["size"] = info[store_path]["closureSize"]
+            metrics["paths"] = len(closure_paths(store_path, info))
+    return metrics
+
+
+def ci_commit() -> str | None:
+    result = subprocess.run(
+        ["git", "rev-parse", "HEAD"],
+        cwd=FLAKE,
+        check=False,  # Not a git checkout
+        text=True,
+        capture_output=True,
+    )
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def ci_regressions(
+    metrics: dict[str, dict[str, Any]],
+    baseline: dict[str, dict[str, Any]],
+    closure_threshold: float,
+    eval_threshold: float,
+) -> list[str]:
+    """
+    Human readable regressions of the metrics compared to the baseline. A threshold of 0 disables the check.
+    """
+    regressions = []
+    for hostname, current in metrics.items():
+        previous = baseline.get(hostname)
+        if not previous:
+            continue
+        if (
+            closure_threshold
+            and current.get("size")
+            and previous.get("size")
+            and current["size"] > previous["size"] * (1 + closure_threshold / 100)
+        ):
+            regressions.append(
+                f"Closure of {hostname} grew from {format_size(previous['size'])} to {format_size(current['size'])}"
+            )
+        if (
+            eval_threshold
+            and current["eval"] - previous["eval"] > CI_EVAL_NOISE
+            and current["eval"] > previous["eval"] * (1 + eval_threshold / 100)
+        ):
+            regressions.append(
+                f"Evaluation of {hostname} slowed from {previous['eval']:.1f}s to {current['eval']:.1f}s"
+            )
+    return regressions
+
+
+def ci_metrics(closure_threshold: float, eval_threshold: float) -> None:
+    """
+    Record the metrics of all hosts for the current commit, and compare them against the previous commit.
+    History is kept as one JSON line per commit in CI_METRICS, the last CI_HISTORY commits are kept.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    hosts = host_names()
+    # NOTE; Hosts are measured concurrently, the recorded evaluation time is CPU time so contention between the
+    # evaluations stays out of the numbers.
+    with (
+        phase("metrics", f"== Collecting metrics of {len(hosts)} hosts =="),
+        ThreadPoolExecutor(max_workers=MAX_PARALLEL_EVALUATIONS) as executor,
+    ):
+        metrics = dict(zip(hosts, executor.map(host_metrics, hosts)))
+
+    history = []
+    if CI_METRICS.is_file():
+        history = [json.loads(x) for x in CI_METRICS.read_text().splitlines() if x]
+    commit = ci_commit()
+    # NOTE; Prefer the parent commit, otherwise the most recent other commit. Re-runs of a commit replace its entry.
+    parent = (
+        subprocess.run(
+            ["git", "rev-parse", "HEAD^"],
+            cwd=FLAKE,
+            check=False,  # First commit or not a git checkout
+            text=True,
+            capture_output=True,
+        ).stdout.strip()
+        if commit
+        else None
+    )
+    others = [x for x in history if x["commit"] != commit or commit is None]
+    entry = next(
+        (x for x in reversed(others) if parent and x["commit"] == parent),
+        others[-1] if others else None,
+    )
+    baseline = entry["hosts"] if entry else {}
+
+    for hostname, current in sorted(metrics.items()):
+        previous = baseline.get(hostname, {})
+        size_delta = (
+            current["size"] - previous["size"]
+            if current.get("size") and previous.get("size")
+            else None
+        )
+        eval_delta = round(current["eval"] - previous["eval"], 2) if previous else None
+        size = (
+            f"{format_size(current['size'])} / {current['paths']} paths"
+            if current.get("size")
+            else "not realised"
+        )
+        changes = ", ".join(
+            x
+            for x in [
+                f"size {'+' if size_delta >= 0 else '-'}{format_size(abs(size_delta))}"
+                if size_delta is not None
+                else "",
+                f"eval {eval_delta:+.1f}s" if eval_delta is not None else "",
+            ]
+            if x
+        )
+        report(
+            f"{hostname:<12} eval {current['eval']:>6.1f}s  {size}  {f'({changes})' if changes else ''}".rstrip(),
+            event="metrics",
+            host=hostname,
+            **current,
+            size_delta=size_delta,
+            eval_delta=eval_delta,
+        )
+
+    history = others + [{"commit": commit, "time": int(time.time()), "hosts": metrics}]
+    CI_METRICS.with_suffix(".tmp").write_text(
+        "".join(
+            json.dumps(x, separators=(",", ":")) + "\n" for x in history[-CI_HISTORY:]
+        )
+    )
+    CI_METRICS.with_suffix(".tmp").replace(CI_METRICS)
+
+    if entry is None:
+        report("No baseline recorded yet, metrics are stored for the next commit")
+        return
+    regressions = ci_regressions(metrics, baseline, closure_threshold, eval_threshold)
+    for regression in regressions:
+        report(regression, event="error", baseline=entry["commit"])
+    if regressions:
+        raise RuntimeError(
+            f"{len(regressions)} metrics regressed compared to commit {entry['commit']}"
+        )
+
+
 @task
-def ci(c: Any) -> None:
+# USAGE; invoke ci [--push file:///var/cache/nix] [--metrics] [--closure-threshold 10] [--eval-threshold 50]
+def ci(
+    c: Any,
+    push: str | None = None,
+    metrics: bool = False,
+    closure_threshold: float = CI_CLOSURE_THRESHOLD,
+    eval_threshold: float = CI_EVAL_THRESHOLD,
+) -> None:
     """
     Similar to task 'check', but also builds the no-system jobs!
+    Optionally pushes the built host closures into a binary cache, see task 'cache-push'.
+
+    --metrics records evaluation time, closure size and amount of paths of each host, and fails when closure size or
+    evaluation time grew more than the threshold (percent, 0 disables) compared to the previous commit. Only useful
+    where CACHE_DIR persists between runs, that's where the baseline is kept.
     """
     system = subprocess.run(
         ["nix", "eval", "--raw", "--impure", "--expr", "builtins.currentSystem"],
@@ -155,9 +1352,213 @@ def ci(c: Any) -> None:
         c.run(
             f"nix-fast-build --no-nom --skip-cached --no-link --flake '{FLAKE}#hydraJobs.no-system'"
         )
+
+    if metrics:
+        ci_metrics(closure_threshold, eval_threshold)
+
+    if push:
+        # NOTE; Closures skipped by --skip-cached are not realised locally, those are already in an upstream cache
+        cache_push_hosts(push, host_names())
     alert_finish()
 
 
+@task
+# USAGE; invoke cache-push file:///var/cache/nix [all|<hostname>] [--full]
+# USAGE; invoke cache-push ssh-ng://nix-cache@buddy.internal.proesmans.eu buddy
+def cache_push(
+    c: Any, store_url: str, hostname: str = "all", full: bool = False
+) -> None:
+    """
+    Push the locally realised host closures into a (nearby) binary cache, so hosts can substitute from there.
+    Only new paths since the last push are copied, use --full to ignore that record.
+    """
+    hosts = host_names() if "all" == hostname else [hostname]
+    cache_push_hosts(store_url, hosts, full=full)
+    alert_finish()
+
+
+def sops_decrypts(encrypted_file: Path, age_key: str) -> str | None:
+    """
+    Decrypt the file in memory with the provided AGE identity. Returns None on success, otherwise the error of sops.
+    """
+    from tempfile import TemporaryDirectory
+
+    # WARN; sops tries every identity it can find, eg ~/.config/sops/age/keys.txt or ~/.ssh/id_ed25519 of the
+    # operator. Any of those would make the check pass for the wrong recipient, only the provided identity is allowed.
+    environment = {
+        k: v
+        for k, v in os.environ.items()
+        if not k.startswith("SOPS_") and k not in ("GNUPGHOME", "SSH_AUTH_SOCK")
+    }
+    environment["SOPS_AGE_KEY"] = age_key
+    with TemporaryDirectory(prefix="sops-verify-") as empty_home:
+        environment["HOME"] = empty_home
+        environment["XDG_CONFIG_HOME"] = empty_home
+        result = subprocess.run(
+            ["sops", "decrypt", encrypted_file.as_posix()],
+            env=environment,
+            check=False,  # Failure is the result
+            capture_output=True,  # NOTE; Plaintext is discarded, never written to disk
+        )
+    if result.returncode == 0:
+        return None
+    lines = result.stderr.decode(errors="replace").strip().splitlines()
+    return lines[-1] if lines else f"sops exited with code {result.returncode}"
+
+
+def secret_recipients(hostname: str, encrypted_file: Path) -> list[str]:
+    """
+    Recipients that must be able to decrypt the file.
+
+    WARN; Must match the creation rules inside {FLAKE}/.sops.yaml !
+    """
+    if encrypted_file.name == decryptor_encrypted_filename_default():
+        return ["development"]
+    return [decryptor_name_default(hostname), "development"]
+
+
+@task
+# USAGE; invoke secrets-verify [--hostname all|<hostname>] [--force]
+def secrets_verify(c: Any, hostname: str = "all", force: bool = False) -> None:
+    """
+    Verify that each encrypted file decrypts for each of its intended recipients (host decrypter and development).
+
+    Results are cached per file content, unchanged files are skipped unless --force is provided.
+    """
+    import hashlib
+    from concurrent.futures import ThreadPoolExecutor
+
+    hosts = host_names() if hostname == "all" else hostname.split(",")
+    cache_file = Path(CACHE_DIR) / "secrets-verify.json"
+    cache: dict[str, bool] = {}
+    if cache_file.is_file():
+        cache = json.loads(cache_file.read_text())
+
+    def file_digest(file_path: Path) -> str:
+        return hashlib.sha256(file_path.read_bytes()).hexdigest()
+
+    # NOTE; A verification result is only valid for the exact content of the encrypted file, and the exact
+    # identity used for decryption. Host decrypter identities are stored inside the keys file of that host.
+    development_fingerprint = file_digest(DEV_KEY)
+    checks: dict[tuple[str, str], str] = {}
+    for host in hosts:
+        keys_file = (
+            FLAKE
+            / "nixosConfigurations"
+            / host
+            / decryptor_encrypted_filename_default()
+        )
+        host_fingerprint = file_digest(keys_file) if keys_file.is_file() else "missing"
+        for encrypted_file in host_secret_files(host):
+            content_digest = file_digest(encrypted_file)
+            for recipient in secret_recipients(host, encrypted_file):
+                identity = (
+                    development_fingerprint
+                    if recipient == "development"
+                    else host_fingerprint
+                )
+                checks[(encrypted_file.relative_to(FLAKE).as_posix(), recipient)] = (
+                    f"{content_digest}:{recipient}:{identity}"
+                )
+
+    results: dict[tuple[str, str], str | None] = {}
+    pending = []
+    for check_key, cache_key in checks.items():
+        if cache.get(cache_key) and not force:
+            results[check_key] = None
+        else:
+            pending.append(check_key)
+    report(
+        f"== Verifying {len(pending)} of {len(checks)} decryptions, {len(checks) - len(pending)} unchanged ==",
+        event="secrets-verify",
+        total=len(checks),
+        pending=len(pending),
+    )
+
+    identities: dict[str, str | None] = {}
+    identity_errors: dict[str, str] = {}
+    if pending:
+        development_key = dev_key_decrypt()
+        identities["development"] = development_key
+        environment = os.environ.copy()
+        environment.pop("SOPS_AGE_KEY_FILE", None)
+        environment["SOPS_AGE_KEY"] = development_key
+        for host in hosts:
+            recipient = decryptor_name_default(host)
+            if not any(x[1] == recipient for x in pending):
+                continue
+            keys_file = (
+                FLAKE
+                / "nixosConfigurations"
+                / host
+                / decryptor_encrypted_filename_default()
+            )
+            result = subprocess.run(
+                [
+                    "sops",
+                    "decrypt",
+                    "--extract",
+                    json.dumps([recipient]),
+                    keys_file.as_posix(),
+                ],
+                env=environment,
+                text=True,
+                check=False,  # Missing identity is reported per file
+                capture_output=True,
+            )
+            identities[recipient] = result.stdout.strip() or None
+            if not identities[recipient]:
+                identity_errors[recipient] = (
+                    f"No decrypter key {recipient} inside {keys_file}"
+                )
+
+    def verify(check_key: tuple[str, str]) -> str | None:
+        file_name, recipient = check_key
+        age_key = identities.get(recipient)
+        if not age_key:
+            return identity_errors.get(recipient, f"No identity for {recipient}")
+        return sops_decrypts(FLAKE / file_name, age_key)
+
+    # NOTE; Each decryption runs as separate sops process, the threads only wait on them
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+        for check_key, error in zip(pending, executor.map(verify, pending)):
+            results[check_key] = error
+            cache[checks[check_key]] = error is None
+            report(
+                None,
+                event="secret-verified",
+                file=check_key[0],
+                recipient=check_key[1],
+                error=error,
+            )
+
+    cache_file.write_text(json.dumps({x: y for x, y in cache.items() if y}))
+
+    # Matrix report; one row per file, one column per kind of recipient
+    cells: dict[tuple[str, str], str] = {}
+    for (file_name, recipient), error in results.items():
+        kind = "development" if recipient == "development" else "decrypter"
+        if error is not None:
+            cells[(file_name, kind)] = "FAIL"
+        else:
+            cells[(file_name, kind)] = (
+                "ok" if (file_name, recipient) in pending else "ok (cached)"
+            )
+    rows = sorted({x[0] for x in checks})
+    width = max(len(x) for x in [*rows, "file"])
+    report(f"{'file':<{width}}  {'decrypter':<11}  development")
+    for row in rows:
+        report(
+            f"{row:<{width}}  {cells.get((row, 'decrypter'), '-'):<11}  {cells.get((row, 'development'), '-')}"
+        )
+
+    failures = {x: y for x, y in results.items() if y is not None}
+    for (file_name, recipient), error in sorted(failures.items()):
+        report(f"FAIL {file_name} for {recipient}: {error}")
+    if failures:
+        raise RuntimeError(f"{len(failures)} of {len(checks)} decryptions failed")
+
+
 @task
 # USAGE: invoke sops-files-update
 def sops_files_update(c: Any) -> None:
@@ -180,24 +1581,163 @@ def sops_files_update(c: Any) -> None:
     )
 
 
-@task
+def host_disk_devices(hostname: str) -> dict[str, str]:
+    """
+    Evaluate the block device path of each disk, by disko disk name, of the provided host.
+    """
+    return json.loads(
+        subprocess.run(
+            [
+                "nix",
+                "eval",
+                "--json",
+                f"{FLAKE}#nixosConfigurations.{hostname}.config.disko.devices.disk",
+                "--apply",
+                "builtins.mapAttrs (_: v: v.device)",
+            ],
+            check=True,
+            text=True,
+            capture_output=True,
+        ).stdout
+    )
+
+
+def build_disk_images(
+    hostname: str,
+    output_directory: Path,
+    pre_format_files: list[tuple[Path, str]],
+    post_format_files: list[tuple[Path, str]],
+    environment: dict[str, str] | None = None,
+) -> None:
+    """
+    Build a raw disk image per disko disk of the host, named <disk name>.raw inside the output directory.
+
+    Pre-format files are available (at the destination path) while partitioning, eg the disk encryption key.
+    Post-format files are copied into the installed filesystem, eg the sops decrypter key.
+    """
+    # NOTE; The image script runs the disko format inside a virtual machine with the host kernel, this is the only
+    # way to inject files at build time without them ending up inside the nix store.
+    # REF; https://github.com/nix-community/disko/blob/master/docs/disko-images.md
+    image_script = subprocess.run(
+        [
+            "nix",
+            "build",
+            f"{FLAKE}#nixosConfigurations.{hostname}.config.system.build.diskoImagesScript",
+            "--no-link",
+            "--print-out-paths",
+        ],
+        env=environment,
+        check=True,
+        text=True,
+        stdout=subprocess.PIPE,
+    ).stdout.strip()
+
+    subprocess.run(
+        [
+            image_script,
+            *(
+                argument
+                for source, destination in pre_format_files
+                for argument in ["--pre-format-files", source.as_posix(), destination]
+            ),
+            *(
+                argument
+                for source, destination in post_format_files
+                for argument in ["--post-format-files", source.as_posix(), destination]
+            ),
+        ],
+        cwd=output_directory,
+        check=True,
+    )
+
+
+def stream_disk_image(image: Path, ssh_connection_string: str, device: str) -> None:
+    """
+    Write the raw disk image onto the device of the target host, compressed in transit and verified by checksum.
+
+    The target must run from another disk, eg a rescue system or nixos installer.
+    """
+    import hashlib
+    import shlex
+
+    image_size = image.stat().st_size
+    device = shlex.quote(device)
+    # NOTE; Zero-blocks of the image are skipped while writing (conv=sparse), which is only correct if the device
+    # range reads as zeroes. Discarding with zeroout is fast on SSD and cloud volumes, otherwise write everything.
+    # NOTE; The image is smaller than the disk, the GPT backup header is moved to the end of the disk afterwards.
+    remote_script = f"""
+        set -euo pipefail
+        if blkdiscard --zeroout --length {image_size} {device} 2>/dev/null; then
+            flags=conv=sparse,fsync,notrunc
+        else
+            flags=conv=fsync,notrunc
+        fi
+        zstd --decompress --stdout | dd of={device} bs=4M iflag=fullblock $flags status=none
+        head --bytes {image_size} {device} | sha256sum
+        if [ -b {device} ]; then sgdisk --move-second-header {device} >/dev/null 2>&1 || true; fi
+    """
+
+    digest = hashlib.sha256()
+    ssh_process = subprocess.Popen(
+        ["ssh", ssh_connection_string, f"bash -c {shlex.quote(remote_script)}"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+    compress_process = subprocess.Popen(
+        ["zstd", "--compress", "--stdout", "--threads=0", "-3"],
+        stdin=subprocess.PIPE,
+        stdout=ssh_process.stdin,
+    )
+    # NOTE; Pipes were requested above, they're never None
+    assert ssh_process.stdin is not None and ssh_process.stdout is not None
+    assert compress_process.stdin is not None
+    # Only the compressor writes into ssh
+    ssh_process.stdin.close()
+
+    # NOTE; The checksum is calculated while streaming, so the image is only read once
+    try:
+        with open(image, "rb") as file_handle:
+            while chunk := file_handle.read(4 * 1024 * 1024):
+                digest.update(chunk)
+                compress_process.stdin.write(chunk)
+        compress_process.stdin.close()
+    except BrokenPipeError:
+        # The remote side stopped reading, its error is reported below
+        pass
+
+    remote_output = ssh_process.stdout.read().decode()
+    if compress_process.wait() != 0 or ssh_process.wait() != 0:
+        raise RuntimeError(f"Streaming {image.name} to {device} failed")
+
+    remote_digest = remote_output.split()[0] if remote_output.strip() else ""
+    if remote_digest != digest.hexdigest():
+        raise RuntimeError(
+            f"Checksum mismatch on {device}, expected {digest.hexdigest()} but got {remote_digest or 'nothing'}"
+        )
+
+
+@task(iterable=["device"])
 # USAGE; invoke deploy development root@10.1.7.100 [-k "development_decrypter"] [-p]
+# USAGE; invoke deploy 02-fart root@10.1.7.100 --image [--device main=/dev/sdb]
 def deploy(
     c: Any,
     hostname: str,
     ssh_connection_string: str,
     key: str = None,
     password_request: bool = False,
+    image: bool = False,
+    device: list[str] | None = None,
 ) -> None:
     """
     Decrypts the secret used for sops-nix, deploys the machine, upload the secret to the host filesystem.
+
+    --image builds the disk image(s) locally and writes them onto the disks of a target running a rescue system or
+    installer, instead of installing with nixos-anywhere. --device <disk name>=<path> overrides the disk device.
     """
+    from tempfile import TemporaryDirectory
 
     host_configuration_dir = FLAKE / "nixosConfigurations" / hostname
     encrypted_file = host_configuration_dir / decryptor_encrypted_filename_default()
-    # Development host is x86, but these systems are aarch64!
-    mismatched_architecture = hostname in ["freddy"]
-
     assert host_configuration_dir.is_dir(), f"""
         There is no configuration folder found for host {hostname}.
         Create a nixos configuration at path `{host_configuration_dir.as_posix()}` first!
@@ -212,8 +1752,17 @@ def deploy(
         f"{FLAKE}#nixosConfigurations.{hostname}.config.system.build.toplevel"
     )
 
-    print(f"Checking if host {hostname} builds..")
-    subprocess.run(["nix", "build", host_attr_path, "--no-link"], check=True)
+    placement = build_placement([hostname])[hostname]
+    build_environment = placement_environment(placement)
+    with phase("build", f"Checking if host {hostname} builds..", host=hostname):
+        store_path = subprocess.run(
+            ["nix", "build", host_attr_path, "--no-link", "--print-out-paths"],
+            env=build_environment,
+            check=True,
+            text=True,
+            stdout=subprocess.PIPE,
+        ).stdout.strip()
+    report(None, event="store-path", host=hostname, path=store_path)
 
     if not ask_user_input(
         f"Install configuration {hostname} on {ssh_connection_string}?"
@@ -225,18 +1774,18 @@ def deploy(
         warnings.warn(f"Defaulting to SSH hostkey secret name: {key}")
 
     # Request user to provide disk encryption password
-    password_generator = None
+    password = None
     if password_request:
-        print("Please provide a DISK encryption secret")
+        report("Please provide a DISK encryption secret", event="password-request")
         # Generate and store a new key using;
         # tr -dc '[:alnum:]' </dev/urandom | head -c64
-        password_generator = pipe_with_data(get_verified_password().encode("UTF-8"))
+        password = get_verified_password()
 
     environment = os.environ.copy()
     environment.pop("SOPS_AGE_KEY_FILE", None)
     environment["SOPS_AGE_KEY"] = dev_key_decrypt()
 
-    print(f"Decrypting AGE identity from {encrypted_file}:{key}..")
+    report(f"Decrypting AGE identity from {encrypted_file}:{key}..")
     age_key = subprocess.run(
         [
             "sops",
@@ -254,9 +1803,9 @@ def deploy(
     if not age_key:
         raise RuntimeError("Decrypted AGE private key is empty")
 
-    with TemporaryDirectory() as deploy_directory:
+    with TemporaryDirectory() as temporary_directory:
         # Prepare filepath and secure file access to store sensitive key material
-        deploy_directory = Path(deploy_directory)
+        deploy_directory = Path(temporary_directory)
         deploy_directory.mkdir(parents=True, exist_ok=True)
         deploy_directory.chmod(0o755)
         decrypter_file_path = deploy_directory / "etc" / "secrets" / "decrypter.age"
@@ -265,6 +1814,55 @@ def deploy(
         with open(decrypter_file_path, "wt", opener=private_opener) as file_handle:
             file_handle.write(age_key)
 
+        if image:
+            devices = host_disk_devices(hostname)
+            for override in device or []:
+                disk_name, _, device_path = override.partition("=")
+                if disk_name not in devices:
+                    raise LookupError(
+                        f"Host {hostname} has no disk named {disk_name}, choose from {list(devices)}"
+                    )
+                devices[disk_name] = device_path
+
+            pre_format_files = []
+            if password is not None:
+                disk_key_path = deploy_directory / "disk.key"
+                with open(disk_key_path, "wt", opener=private_opener) as file_handle:
+                    file_handle.write(password)
+                pre_format_files.append((disk_key_path, REMOTE_LUKS_SECRET_PATH))
+
+            # NOTE; Images are large, keep them next to the other cache files instead of inside tmpfs
+            with TemporaryDirectory(dir=CACHE_DIR, prefix="images-") as image_directory:
+                with phase("image", host=hostname):
+                    build_disk_images(
+                        hostname,
+                        Path(image_directory),
+                        pre_format_files,
+                        [(decrypter_file_path, "/etc/secrets/decrypter.age")],
+                        build_environment,
+                    )
+                for disk_name, device_path in devices.items():
+                    with phase(
+                        "stream",
+                        f"Writing disk {disk_name} to {ssh_connection_string}:{device_path}..",
+                        host=hostname,
+                        disk=disk_name,
+                        device=device_path,
+                    ):
+                        stream_disk_image(
+                            Path(image_directory) / f"{disk_name}.raw",
+                            ssh_connection_string,
+                            device_path,
+                        )
+
+            report(
+                f"Disks of {hostname} are written, reboot {ssh_connection_string} from disk to finish the install",
+                event="installed",
+                host=hostname,
+            )
+            alert_finish()
+            return
+
         deploy_flags = []
         deploy_flags.append("--debug")
         # "--no-substitute-on-destination",
@@ -277,9 +1875,12 @@ def deploy(
         #
         # "--option accept-flake-config true",
 
-        if mismatched_architecture:
+        if placement["builder"] is None:
+            # No native builder available, the target builds its own system
             deploy_flags.append("--build-on")
             deploy_flags.append("remote")
+        elif placement["nix_config"]:
+            environment["NIX_CONFIG"] = build_environment["NIX_CONFIG"]
 
         # NOTE; The (nixos-anywhere) default is to let the target pull packages from the caches first, and if they not exist there
         # the current (buildhost) host will push the packages.
@@ -290,9 +1891,13 @@ def deploy(
             # the external nix caches.
             deploy_flags.append("--no-substitute-on-destination")
 
+        password_generator = (
+            pipe_with_data(password.encode("UTF-8")) if password is not None else None
+        )
         with (
-            password_generator or nullcontext()
-        ) as password_descriptor:  # ->N (integer)
+            password_generator or nullcontext() as password_descriptor,  # ->N (integer)
+            phase("install", host=hostname, target=ssh_connection_string),
+        ):
             # ERROR; Cannot use sops --exec-file because we need to pass a full file structure to nixos-anywhere
             subprocess.run(
                 [
@@ -341,7 +1946,7 @@ def filesystem_rebuild(c: Any, flake_attr: str) -> None:
         f"{FLAKE}#nixosConfigurations.{flake_attr}.config.system.build.formatScript"
     )
 
-    print(f"Checking if format script builds for {flake_attr}..")
+    report(f"Checking if format script builds for {flake_attr}..")
     format_script = subprocess.run(
         [
             "nix",
@@ -355,8 +1960,9 @@ def filesystem_rebuild(c: Any, flake_attr: str) -> None:
         text=True,
         capture_output=True,
     ).stdout.strip()
+    report(None, event="store-path", host=flake_attr, path=format_script)
 
-    print(f"Evaluating machine facts to find {flake_attr}..")
+    report(f"Evaluating machine facts to find {flake_attr}..")
     text_machines = subprocess.run(
         [
             "nix",
@@ -384,94 +1990,324 @@ def filesystem_rebuild(c: Any, flake_attr: str) -> None:
         None,
     )
 
-    if not ssh_connection_string:
-        raise LookupError(
-            "No ssh moniker found for host attribute. Set `proesmans.facts.hostName` in nixos config"
-        )
+    if not ssh_connection_string:
+        raise LookupError(
+            "No ssh moniker found for host attribute. Set `proesmans.facts.hostName` in nixos config"
+        )
+
+    if not ask_user_input(
+        f"Update filesystems for {flake_attr} on {ssh_connection_string}?"
+    ):
+        return
+
+    subprocess.run(
+        ["nix", "copy", "--to", f"ssh://{ssh_connection_string}", format_script],
+        check=True,
+    )
+
+    with phase("format", host=flake_attr, target=ssh_connection_string):
+        subprocess.run(
+            ["ssh", ssh_connection_string, f"sudo {format_script}"], check=True
+        )
+
+    alert_finish()
+
+
+@task
+# USAGE; invoke dev-rebuild
+def dev_rebuild(c: Any, boot: bool = False) -> None:
+    """
+    Rebuild the current machine with the host configuration for "development"
+    """
+    import platform
+
+    this_hostname = platform.node()
+    if this_hostname != "development":
+        raise RuntimeError(
+            f"Hostname is '{this_hostname}', not 'development'. Refusing to clobber configuration"
+        )
+
+    if boot:
+        report(
+            "== WARNING ==\nBoot flag used. You must reboot the host manually after nixos-rebuild is done!",
+            event="warning",
+        )
+
+    with phase("compare", host="development"):
+        store_path = host_toplevel_path("development")
+    if activation_is_noop(store_path, system_links(None), boot):
+        report(
+            f"== development already runs {store_path}, skipping activation ==",
+            event="skipped",
+            host="development",
+            path=store_path,
+        )
+        return
+
+    with phase("activate", host="development"):
+        subprocess.run(
+            [
+                "sudo",
+                "nixos-rebuild",
+                "--flake",
+                f"{FLAKE}#development",
+                "boot" if boot else "switch",
+            ],
+            check=True,
+        )
+
+    if boot:
+        report(
+            "== WARNING ==\nBoot flag used. You must reboot the host manually after nixos-rebuild is done!",
+            event="warning",
+        )
+
+    alert_finish()
+
+
+def initrd_ssh_arguments(ssh_connection_string: str, port: int) -> list[str]:
+    return [
+        "ssh",
+        # Disable storing host keys, the host key is dynamic
+        "-o",
+        "StrictHostKeyChecking=no",
+        # Skip verifying against known host keys, the host key is dynamic
+        "-o",
+        "UserKnownHostsFile=/dev/null",
+        "-p",
+        str(port),
+        # WARN; Assumed root user during boot phase-1
+        f"root@{ssh_connection_string}",
+    ]
+
 
-    if not ask_user_input(
-        f"Update filesystems for {flake_attr} on {ssh_connection_string}?"
-    ):
-        return
+def wait_for_any_port(
+    address: str, ports: list[int], deadline: float, interval: float
+) -> int | None:
+    """
+    Poll until any of the ports accepts TCP connections, or the deadline (monotonic clock) passes.
+    Returns the first port, in order of the provided list, that accepted a connection.
+    """
+    import socket
 
-    subprocess.run(
-        ["nix", "copy", "--to", f"ssh://{ssh_connection_string}", format_script],
-        check=True,
-    )
+    while time.monotonic() < deadline:
+        for port in ports:
+            try:
+                with socket.create_connection((address, port), timeout=interval):
+                    return port
+            except OSError:
+                continue
+        time.sleep(interval)
+    return None
 
-    subprocess.run(["ssh", ssh_connection_string, f"sudo {format_script}"], check=True)
 
-    alert_finish()
+def wait_for_port(address: str, port: int, deadline: float, interval: float) -> bool:
+    """
+    Poll until the port accepts TCP connections, or the deadline (monotonic clock) passes.
+    """
+    return wait_for_any_port(address, [port], deadline, interval) is not None
 
 
-@task
-# USAGE; invoke dev-rebuild
-def dev_rebuild(c: Any, boot: bool = False) -> None:
+def unlock_host(
+    hostname: str,
+    ssh_connection_string: str,
+    passphrase: str,
+    initrd_port: int,
+    ssh_port: int,
+    timeout: int,
+    interval: float,
+) -> float | None:
     """
-    Rebuild the current machine with the host configuration for "development"
+    Wait for the pre-boot environment of the host, provide the disk decryption passphrase and wait until the
+    booted system answers. Returns the seconds until unlocked, or None if the host was already unlocked.
     """
-    this_hostname = platform.node()
-    if this_hostname != "development":
-        raise RuntimeError(
-            f"Hostname is '{this_hostname}', not 'development'. Refusing to clobber configuration"
-        )
+    start = time.monotonic()
+    deadline = start + timeout
 
-    if boot:
-        print("== WARNING ==")
-        print(
-            "Boot flag used. You must reboot the host manually after nixos-rebuild is done!"
-        )
+    # NOTE; The booted system answering without pre-boot environment means the host stayed up, eg after a partial
+    # power event.
+    port = wait_for_any_port(
+        ssh_connection_string, [initrd_port, ssh_port], deadline, interval
+    )
+    if port is None:
+        raise TimeoutError(f"Pre-boot environment of {hostname} did not answer")
+    if port != initrd_port:
+        return None
+    report(
+        None,
+        event="unlock-prompt",
+        host=hostname,
+        duration=time.monotonic() - start,
+    )
 
+    # NOTE; The authorized key forces command "systemctl default", which blocks on the password agent of the
+    # (forced) tty. The passphrase is typed into that tty through stdin. The session is torn down by the switch
+    # out of initrd, so the exit code is meaningless.
     subprocess.run(
         [
-            "sudo",
-            "nixos-rebuild",
-            "--flake",
-            f"{FLAKE}#development",
-            "boot" if boot else "switch",
+            "ssh",
+            # Force a tty, even though stdin is not a terminal
+            "-tt",
+            *initrd_ssh_arguments(ssh_connection_string, initrd_port)[1:],
         ],
-        check=True,
+        input=f"{passphrase}\n",
+        text=True,
+        capture_output=True,
+        check=False,
+        timeout=timeout,
     )
 
-    if boot:
-        print("== WARNING ==")
-        print(
-            "Boot flag used. You must reboot the host manually after nixos-rebuild is done!"
+    if not wait_for_port(ssh_connection_string, ssh_port, deadline, interval):
+        raise TimeoutError(
+            f"Host {hostname} did not boot after unlock, wrong passphrase?"
         )
+    return time.monotonic() - start
 
-    alert_finish()
+
+def unlock_fleet(
+    hosts: dict[str, str],
+    key: str | None,
+    initrd_port: int,
+    ssh_port: int,
+    timeout: int,
+    interval: float,
+) -> None:
+    """
+    Unlock all provided hosts concurrently. The passphrase is either asked once, or decrypted per host from
+    key <key> inside the decrypter keys file of that host.
+    """
+    import getpass
+    from concurrent.futures import ThreadPoolExecutor
+
+    passphrases: dict[str, str] = {}
+    if key:
+        environment = os.environ.copy()
+        environment.pop("SOPS_AGE_KEY_FILE", None)
+        environment["SOPS_AGE_KEY"] = dev_key_decrypt()
+
+        for hostname in hosts:
+            encrypted_file = (
+                FLAKE
+                / "nixosConfigurations"
+                / hostname
+                / decryptor_encrypted_filename_default()
+            )
+            passphrases[hostname] = subprocess.run(
+                [
+                    "sops",
+                    "decrypt",
+                    "--extract",
+                    json.dumps([key]),
+                    encrypted_file.as_posix(),
+                ],
+                env=environment,
+                text=True,
+                check=True,
+                capture_output=True,
+            ).stdout.strip()
+    else:
+        if OUTPUT_JSON:
+            passphrase = sys.stdin.readline().rstrip("\n")
+        else:
+            passphrase = getpass.getpass("Disk encryption passphrase: ")
+        passphrases = {hostname: passphrase for hostname in hosts}
+
+    if not all(passphrases.values()):
+        raise ValueError("Disk encryption passphrase cannot be empty")
+
+    report(f"== Unlocking {len(hosts)} hosts: {', '.join(hosts)} ==")
+    with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+        futures = {
+            hostname: executor.submit(
+                unlock_host,
+                hostname,
+                ssh_connection_string,
+                passphrases[hostname],
+                initrd_port,
+                ssh_port,
+                timeout,
+                interval,
+            )
+            for hostname, ssh_connection_string in hosts.items()
+        }
+
+        failed = []
+        for hostname, future in futures.items():
+            try:
+                duration = future.result()
+                if duration is None:
+                    report(
+                        f"{hostname}: already unlocked",
+                        event="already-unlocked",
+                        host=hostname,
+                    )
+                    continue
+                report(
+                    f"{hostname}: unlocked after {duration:.1f}s",
+                    event="unlocked",
+                    host=hostname,
+                    duration=duration,
+                )
+            except (OSError, subprocess.SubprocessError) as e:
+                failed.append(hostname)
+                report(
+                    f"{hostname}: FAILED, {e}",
+                    event="error",
+                    host=hostname,
+                    error=str(e),
+                )
+
+    if failed:
+        raise RuntimeError(f"Failed to unlock hosts: {', '.join(failed)}")
 
 
 @task
 # USAGE; invoke unlock freddy
-def unlock(c: Any, flake_attr: str) -> None:
+# USAGE; invoke unlock all|freddy,01-fart [-k "disk_passphrase"] [--timeout 900]
+def unlock(
+    c: Any,
+    flake_attr: str,
+    key: str | None = None,
+    timeout: int = 900,
+    interval: int = 5,
+    initrd_port: int = INITRD_SSH_PORT,
+    ssh_port: int = 22,
+) -> None:
     """
     Open an interactive session into the pre-boot environment of the host to provide disk decryption password.
+
+    Fleet mode ("all" hosts with encrypted disks, or a comma separated list) waits for all pre-boot environments
+    concurrently and provides the passphrase to each host.
     """
-    print(f"Evaluating machine facts to find {flake_attr}..")
-    text_machines = subprocess.run(
-        [
-            "nix",
-            "eval",
-            "--json",
-            f"{FLAKE}#facts",
-            "--apply",
-            # ERROR; The evalModule system asserts when accessing a config value for unset option.
-            # ERROR; The to-JSON export function asserts when it encounters a function.
-            # TODO; Use host-data before fallback to dns-name.
-            'builtins.mapAttrs (_: v: "${v.hostName}.${v.domainName}")',
-        ],
-        check=True,
-        text=True,
-        capture_output=True,
-    ).stdout.strip()
+    report(f"Evaluating machine facts to find {flake_attr}..")
+    machines = host_facts()
+
+    if "all" == flake_attr or "," in flake_attr:
+        selection = (
+            [k for k, v in machines.items() if v["encryptedDisks"]]
+            if "all" == flake_attr
+            else flake_attr.split(",")
+        )
+        unknown = [x for x in selection if x not in machines]
+        if unknown:
+            raise LookupError(f"No facts found for hosts: {', '.join(unknown)}")
+
+        unlock_fleet(
+            {x: machines[x]["connection"] for x in selection},
+            key,
+            initrd_port,
+            ssh_port,
+            timeout,
+            interval,
+        )
+        alert_finish()
+        return
 
-    machines = json.loads(text_machines)
     ssh_connection_string = next(
         (
-            host_name
-            for moniker, host_name in machines.items()
-            if flake_attr == moniker or host_name.startswith(flake_attr)
+            v["connection"]
+            for moniker, v in machines.items()
+            if flake_attr == moniker or v["connection"].startswith(flake_attr)
         ),
         None,
     )
@@ -481,85 +2317,39 @@ def unlock(c: Any, flake_attr: str) -> None:
         Make sure the desired host returns the expected option host-facts.<moniker>.hostName using the nixos configuration options `proesmans.facts.hostName = "<TODO>";`
     """
     subprocess.run(
-        [
-            "ssh",
-            # Disable storing host keys, the host key is dynamic
-            "-o",
-            "StrictHostKeyChecking=no",
-            # Skip verifying against known host keys, the host key is dynamic
-            "-o",
-            "UserKnownHostsFile=/dev/null",
-            # WARN; Hardcoded port in priviledged range
-            "-p",
-            "23",
-            # WARN; Assumed root user during boot phase-1
-            f"root@{ssh_connection_string}",
-        ],
+        initrd_ssh_arguments(ssh_connection_string, initrd_port),
         check=True,
     )
 
 
-@task
-# USAGE; invoke rebuild development
-def rebuild(c: Any, flake_attr: str, yes: bool = False, boot: bool = False) -> None:
+def rebuild_host(
+    hostname: str,
+    ssh_connection_string: str,
+    yes: bool,
+    boot: bool,
+    environment: dict[str, str],
+    built: bool = False,
+) -> str:
     """
-    Build a host configuration and activate it on the machine.
+    Build and activate the host configuration.
+    Returns the outcome; "updated" or "declined".
     """
     host_attr_path = (
-        f"{FLAKE}#nixosConfigurations.{flake_attr}.config.system.build.toplevel"
-    )
-
-    if boot:
-        print("== WARNING ==")
-        print(
-            "Boot flag used. You must reboot the host manually after nixos-rebuild is done!"
-        )
-
-    if not yes:
-        print(f"== Checking if host {flake_attr} builds ==")
-        subprocess.run(
-            ["nix-fast-build", "--flake", host_attr_path, "--no-link"], check=True
-        )
-
-    print(f"== Evaluating machine facts to find {flake_attr} ==")
-    text_machines = subprocess.run(
-        [
-            "nix",
-            "eval",
-            "--json",
-            f"{FLAKE}#facts",
-            "--apply",
-            # ERROR; The evalModule system asserts when accessing a config value for unset option.
-            # ERROR; The to-JSON export function asserts when it encounters a function.
-            # TODO; Use host-data before fallback to dns-name.
-            'builtins.mapAttrs (_: v: "${v.hostName}.${v.domainName}")',
-        ],
-        check=True,
-        text=True,
-        capture_output=True,
-    ).stdout.strip()
-
-    machines = json.loads(text_machines)
-    ssh_connection_string = next(
-        (
-            host_name
-            for moniker, host_name in machines.items()
-            if flake_attr == moniker or host_name.startswith(flake_attr)
-        ),
-        None,
+        f"{FLAKE}#nixosConfigurations.{hostname}.config.system.build.toplevel"
     )
 
-    if not ssh_connection_string:
-        raise LookupError(
-            "No ssh moniker found for hostname. Set `proesmans.facts.hostName` in nixos config"
-        )
+    if not (yes or built):
+        with phase("build", f"== Checking if host {hostname} builds ==", host=hostname):
+            subprocess.run(
+                ["nix-fast-build", "--flake", host_attr_path, "--no-link"],
+                env=environment,
+                check=True,
+            )
 
-    if not yes:
-        ask = input(
-            f"Update configuration {flake_attr} on {ssh_connection_string}? [y/N] "
-        )
-        if ask != "y":
-            return
+    if not yes and not ask_user_input(
+        f"Update configuration {hostname} on {ssh_connection_string}?"
+    ):
+        return "declined"
 
     additional_switches = []
     additional_switches.append("--sudo")
@@ -568,34 +2358,35 @@ def rebuild(c: Any, flake_attr: str, yes: bool = False, boot: bool = False) -> N
         # Download as much from online caches because the link between development- and target host is slow.
         additional_switches.append("--use-substitutes")
 
-    subprocess.run(
-        [
-            "nixos-rebuild",
-            "--flake",
-            f"{FLAKE}#{flake_attr}",
-            "--target-host",
-            ssh_connection_string,
-            *additional_switches,
-            "boot" if boot else "switch",
-        ],
-        check=True,
-    )
-
-    if boot:
-        print("== WARNING ==")
-        print(
-            "Boot flag used. You must reboot the host manually after nixos-rebuild is done!"
+    with phase("activate", host=hostname, target=ssh_connection_string):
+        subprocess.run(
+            [
+                "nixos-rebuild",
+                "--flake",
+                f"{FLAKE}#{hostname}",
+                "--target-host",
+                ssh_connection_string,
+                *additional_switches,
+                "boot" if boot else "switch",
+            ],
+            env=environment,
+            check=True,
         )
 
-    print("== Pinning host closure as garbage root (nix gcroot) ==")
+    report("== Pinning host closure as garbage root (nix gcroot) ==")
     # The machine builds and is deployed succesfully, pinning should succeed IF we have the closure downloaded locally
     realised_path_exec = subprocess.run(
-        ["nix", "path-info", host_attr_path], text=True, capture_output=True
+        ["nix", "path-info", host_attr_path],
+        text=True,
+        capture_output=True,
+        check=False,  # Unrealised path is handled below
     )
-    if realised_path_exec != 0:
+    if realised_path_exec.returncode != 0:
         # There is no local copy of the system closure, build it first (implies copy to local system if remote-builder is used)..
         subprocess.run(
-            ["nix-fast-build", "--flake", host_attr_path, "--no-link"], check=True
+            ["nix-fast-build", "--flake", host_attr_path, "--no-link"],
+            env=environment,
+            check=True,
         )
         # ..then retry capturing the path of the built closure
         realised_path_exec = subprocess.run(
@@ -605,19 +2396,342 @@ def rebuild(c: Any, flake_attr: str, yes: bool = False, boot: bool = False) -> N
             capture_output=True,
         )
 
-    subprocess.run(
-        [
-            "nix-store",
-            "--add-root",
-            f"{CACHE_DIR}/{flake_attr}.pin",
-            "--realise",
-            realised_path_exec.stdout.strip(),
-        ],
-        check=True,
+    store_path = realised_path_exec.stdout.strip()
+    # NOTE; With boot, the currently active system stays running until the next reboot
+    record_running_systems(
+        hostname, {store_path, *running_systems(hostname)} if boot else {store_path}
+    )
+    pin_closure(hostname, store_path)
+    report(None, event="store-path", host=hostname, path=store_path)
+    return "updated"
+
+
+@task
+# USAGE; invoke rebuild development
+# USAGE; invoke rebuild all|buddy,freddy [--yes] [--boot] [--no-probe]
+def rebuild(
+    c: Any, flake_attr: str, yes: bool = False, boot: bool = False, probe: bool = True
+) -> None:
+    """
+    Build a host configuration and activate it on the machine.
+
+    Hosts that already run the exact configuration are skipped. Multiple hosts are rolled out one after the other.
+    After activation the services of the host are probed, on failure the previous generation is activated again
+    and the rollout stops. Disable with --no-probe.
+    """
+    if boot:
+        report(
+            "== WARNING ==\nBoot flag used. You must reboot the host manually after nixos-rebuild is done!",
+            event="warning",
+        )
+
+    # NOTE; Batch mode with --yes also skips the confirmation build
+    yes = yes or ASSUME_YES
+
+    report(f"== Evaluating machine facts to find {flake_attr} ==")
+    facts = host_facts()
+    hosts = remote_hosts(facts) if flake_attr == "all" else flake_attr.split(",")
+    connections = {}
+    for hostname in hosts:
+        ssh_connection_string = next(
+            (
+                x["connection"]
+                for moniker, x in facts.items()
+                if hostname == moniker or x["connection"].startswith(hostname)
+            ),
+            None,
+        )
+        if not ssh_connection_string:
+            raise LookupError(
+                f"No ssh moniker found for hostname {hostname}. Set `proesmans.facts.hostName` in nixos config"
+            )
+        connections[hostname] = ssh_connection_string
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def compare(hostname: str) -> tuple[str, dict[str, str] | None]:
+        with phase("compare", host=hostname, target=connections[hostname]):
+            return host_toplevel_path(hostname), system_links(connections[hostname])
+
+    # NOTE; One evaluation and one ssh session per host are a lot cheaper than building, copy-checking the closure
+    # and running the activation script.
+    outcomes: dict[str, list[str]] = {}
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_EVALUATIONS) as executor:
+        systems = dict(zip(hosts, executor.map(compare, hosts)))
+    for hostname, (store_path, links) in systems.items():
+        if not activation_is_noop(store_path, links, boot):
+            continue
+        # NOTE; A no-op activation implies the links of the host are known
+        assert links is not None
+        report(
+            f"== {hostname} already runs {store_path}, skipping activation ==",
+            event="skipped",
+            host=hostname,
+            path=store_path,
+        )
+        record_running_systems(hostname, set(links.values()))
+        pin = PIN_STORE / hostname / Path(store_path).name
+        if pin.is_symlink():
+            os.utime(pin, follow_symlinks=False)
+        outcomes.setdefault("skipped", []).append(hostname)
+    hosts = [x for x in hosts if x not in outcomes.get("skipped", [])]
+
+    placement = build_placement(hosts) if hosts else {}
+    environments = {x: placement_environment(placement[x]) for x in hosts}
+    built: set[str] = set()
+    if len(hosts) > 1:
+        # NOTE; Build all closures up front, concurrently on their own builder, activation is one host at a time.
+        # Hosts without native builder are built by nixos-rebuild during activation.
+        def build(hostname: str) -> str:
+            with phase("build", host=hostname, builder=placement[hostname]["builder"]):
+                subprocess.run(
+                    [
+                        "nix",
+                        "build",
+                        f"{FLAKE}#nixosConfigurations.{hostname}.config.system.build.toplevel",
+                        "--no-link",
+                    ],
+                    env=environments[hostname],
+                    check=True,
+                )
+            return hostname
+
+        native = [x for x in hosts if placement[x]["builder"] is not None]
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL_EVALUATIONS) as executor:
+            built = set(executor.map(build, native))
+
+    for index, hostname in enumerate(hosts):
+        # NOTE; Only services that are healthy before activation can fail the activation, some services are not
+        # reachable from this machine by design.
+        gated = probe and not boot and bool(facts.get(hostname, {}).get("service"))
+        baseline = probe_hosts(facts, [hostname]) if gated else {}
+        try:
+            outcome = rebuild_host(
+                hostname,
+                connections[hostname],
+                yes,
+                boot,
+                environments[hostname],
+                built=hostname in built,
+            )
+        except subprocess.CalledProcessError as e:
+            if len(hosts) == 1:
+                raise
+            report(f"Rebuild of {hostname} failed: {e}", event="error", host=hostname)
+            outcome = "failed"
+
+        if outcome == "updated" and gated:
+            with phase("probe", host=hostname):
+                results = probe_hosts(facts, [hostname])
+            unhealthy = {
+                name: error
+                for (_, name), error in results.items()
+                if error is not None and baseline.get((hostname, name)) is None
+            }
+            if unhealthy:
+                for name, error in unhealthy.items():
+                    report(
+                        f"Service {name} of {hostname} is unhealthy: {error}",
+                        event="error",
+                        host=hostname,
+                        service=name,
+                    )
+                store_path, links = systems[hostname]
+                # NOTE; The system that was active right before this activation is the rollback target, the pins
+                # only stand in when the host didn't report it.
+                previous = (
+                    links["current"]
+                    if links and links["current"] != store_path
+                    else None
+                )
+                if previous is None:
+                    previous = next(
+                        (
+                            os.readlink(x)
+                            for x in host_pins(hostname)
+                            if os.readlink(x) != store_path
+                        ),
+                        None,
+                    )
+                if previous is None:
+                    report(
+                        f"No previous generation of {hostname} to roll back to",
+                        event="error",
+                        host=hostname,
+                    )
+                    outcome = "failed"
+                else:
+                    try:
+                        with phase(
+                            "rollback",
+                            f"== Rolling back {hostname} to {previous} ==",
+                            host=hostname,
+                            path=previous,
+                        ):
+                            rollback_host(connections[hostname], previous)
+                        record_running_systems(hostname, {previous})
+                        pins_rollback(hostname, store_path, previous)
+                        outcome = "rolled-back"
+                    except subprocess.CalledProcessError as e:
+                        # NOTE; The host needs manual attention, still report and gate the rollout as usual
+                        report(
+                            f"Rollback of {hostname} failed: {e}",
+                            event="error",
+                            host=hostname,
+                        )
+                        outcome = "rollback-failed"
+
+        outcomes.setdefault(outcome, []).append(hostname)
+        if outcome in ("failed", "rolled-back", "rollback-failed") and probe:
+            # Gate; don't continue the rollout with a configuration that breaks hosts
+            if hosts[index + 1 :]:
+                outcomes["not-attempted"] = hosts[index + 1 :]
+            break
+
+    evicted, store_size = pins_prune(PIN_GENERATIONS, parse_size(PIN_BUDGET))
+    for pin in evicted:
+        report(f"Evicted pin {pin}", event="pin-evicted", pin=pin)
+    report(
+        f"Pinned closures take {format_size(store_size)} of {PIN_BUDGET}",
+        event="pin-store",
+        size=store_size,
     )
+    if store_size > parse_size(PIN_BUDGET):
+        report(
+            f"Pinned closures exceed the budget of {PIN_BUDGET}, the remaining pins are kept generations or running",
+            event="warning",
+        )
+
+    report(
+        "== Summary ==\n"
+        + "\n".join(f"{x}: {', '.join(y)}" for x, y in sorted(outcomes.items())),
+        event="summary",
+        **outcomes,
+    )
+
+    if boot and "updated" in outcomes:
+        report(
+            "== WARNING ==\nBoot flag used. You must reboot the host manually after nixos-rebuild is done!",
+            event="warning",
+        )
+
+    failures = [
+        x
+        for outcome in ("failed", "rolled-back", "rollback-failed")
+        for x in outcomes.get(outcome, [])
+    ]
+    if failures:
+        raise RuntimeError(f"Rebuild failed for {', '.join(failures)}")
     alert_finish()
 
 
+@task
+# USAGE; invoke probe [--hostname all|<hostname>] [--timeout 3] [--attempts 3]
+def probe(
+    c: Any,
+    hostname: str = "all",
+    timeout: int = PROBE_TIMEOUT,
+    attempts: int = PROBE_ATTEMPTS,
+) -> None:
+    """
+    Probe all services declared in the facts inventory of the hosts, concurrently.
+
+    HTTP(S) services must answer without server error, other services must accept a TCP connection.
+    """
+    facts = host_facts()
+    hosts = list(facts) if hostname == "all" else hostname.split(",")
+    results = probe_hosts(facts, hosts, timeout=timeout, attempts=attempts)
+    for (host, name), error in sorted(results.items()):
+        uri = facts[host]["service"][name].get("uri")
+        report(
+            f"{host:<12} {name:<20} {'ok' if error is None else 'FAIL':<4}  {uri}  {error or ''}".rstrip()
+        )
+
+    failures = [x for x, error in results.items() if error is not None]
+    if failures:
+        raise RuntimeError(f"{len(failures)} of {len(results)} services are unhealthy")
+
+
+@task
+# USAGE; invoke pins [--hostname all|<hostname>] [--refresh] [--prune] [--keep 3] [--budget 30G]
+def pins(
+    c: Any,
+    hostname: str = "all",
+    refresh: bool = False,
+    prune: bool = False,
+    keep: int = PIN_GENERATIONS,
+    budget: str = PIN_BUDGET,
+) -> None:
+    """
+    List the pinned system closures per host, and evict least recently used pins beyond the store-size budget.
+
+    --refresh asks each host over ssh which closures it's running, those are never evicted. --prune only evicts
+    pins of the selected hosts.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    hosts = [x for x in pinned_hosts() if hostname == "all" or x in hostname.split(",")]
+
+    if refresh and hosts:
+        facts = host_facts()
+        reachable = [x for x in hosts if x in facts]
+        with ThreadPoolExecutor(max_workers=len(reachable) or 1) as executor:
+            probes = executor.map(
+                probe_running_systems, [facts[x]["connection"] for x in reachable]
+            )
+            for host, running in zip(reachable, probes):
+                if running is None:
+                    report(
+                        f"Host {host} is unreachable, keeping its last known running systems",
+                        event="warning",
+                        host=host,
+                    )
+                    continue
+                record_running_systems(host, running)
+
+    if prune:
+        evicted, _ = pins_prune(keep, parse_size(budget), hosts=hosts)
+        for pin in evicted:
+            report(f"Evicted pin {pin}", event="pin-evicted", pin=pin)
+
+    pinned = {host: host_pins(host) for host in hosts}
+    targets = [os.readlink(pin) for x in pinned.values() for pin in x]
+    info = store_path_info(sorted(set(targets))) if targets else {}
+    # NOTE; Nothing is evictable, this measures the pinned closures as they are now
+    _, store_size = pins_prune(keep, parse_size(budget), dry_run=True, hosts=[])
+    for host, host_pinned in pinned.items():
+        running = running_systems(host)
+        report(f"== {host} ==")
+        for generation, pin in enumerate(host_pinned):
+            target = os.readlink(pin)
+            closure_size = info.get(target, {}).get("closureSize", 0)
+            age_days = (time.time() - pin.lstat().st_mtime) / 86400
+            flags = [
+                *(["running"] if target in running else []),
+                *(["kept"] if generation < keep else []),
+            ]
+            report(
+                f"  {generation:>2}  {age_days:>5.1f} days  {format_size(closure_size):>10}  {target}  {' '.join(flags)}",
+                event="pin",
+                host=host,
+                generation=generation,
+                path=target,
+                closure_size=closure_size,
+                last_used=pin.lstat().st_mtime,
+                running=target in running,
+            )
+    report(
+        f"Pinned closures take {format_size(store_size)} of {budget}",
+        event="pin-store",
+        size=store_size,
+    )
+    if store_size > parse_size(budget):
+        report(
+            f"Pinned closures exceed the budget of {budget}, the remaining pins are kept generations, running or of other hosts",
+            event="warning",
+        )
+
+
 @task
 # USAGE; invoke secret-edit development [-f "secrets.encrypted.yaml"] [--binary]
 def secret_edit(
@@ -681,6 +2795,7 @@ def ssh_key_create(
     """
     Create and encrypt a new SSH private host key.
     """
+    from tempfile import TemporaryDirectory
 
     host_configuration_dir = FLAKE / "nixosConfigurations" / hostname
     encrypted_file = host_configuration_dir / file
@@ -779,8 +2894,12 @@ def ssh_key_create(
             check=True,
         )
 
-    print(
-        f"Private key succesfully encrypted! Below is the corresponding public key\n{public_key}"
+    report(
+        f"Private key succesfully encrypted! Below is the corresponding public key\n{public_key}",
+        event="public-key",
+        host=hostname,
+        key=key,
+        public_key=public_key.strip(),
     )
 
 
@@ -826,7 +2945,12 @@ def decrypter_key_create(c: Any, hostname: str, key: str = None) -> None:
 
     # Print everything except last line (presumably private key) to the terminal
     # for the user to further process.
-    print("\n".join(age_key.splitlines()[:-1]))
+    report(
+        "\n".join(age_key.splitlines()[:-1]),
+        event="public-key",
+        host=hostname,
+        public_key=age_key.splitlines()[-2].rpartition(" ")[2],
+    )
 
     if not key:
         key = decryptor_name_default(hostname)
@@ -890,19 +3014,224 @@ def format(c: Any) -> None:
     subprocess.run(["nix", "fmt", PROJECT_DIR], cwd=FLAKE, check=False)
 
 
-@task
-def documentation(c: Any) -> None:
+def documentation_fingerprint() -> str:
     """
-    Build host and network documentation
+    Cheap change marker of the configuration flake and the documentation flake together. Nothing is evaluated, only
+    file metadata is read.
     """
-    subprocess.run(
-        [
-            "nix",
-            "build",
-            f"{DOCS}#topology.x86_64-linux.config.output",
-            "--override-input",
-            "configuration",
-            FLAKE,
-        ],
-        check=True,
+    import hashlib
+
+    snapshot = snapshot_tree(FLAKE, DOCS)
+    return hashlib.sha256(json.dumps(sorted(snapshot.items())).encode()).hexdigest()
+
+
+def documentation_build_incremental() -> None:
+    """
+    Skip the topology build when no source file changed since the last successful build.
+
+    NOTE; This is a whole-build skip. nix-topology evaluates all hosts inside one evaluation and can't assemble partial
+    results, so any change costs the same as a non-incremental build. What is saved is the complete evaluation and
+    build when nothing changed, eg on each unrelated save in watch mode.
+    """
+    topology_cache = Path(CACHE_DIR) / "topology"
+    topology_cache.mkdir(parents=True, exist_ok=True)
+    output_link = topology_cache / "result"
+    fingerprint_file = topology_cache / "fingerprint"
+
+    fingerprint = documentation_fingerprint()
+    changed = (
+        not fingerprint_file.is_file() or fingerprint_file.read_text() != fingerprint
+    )
+
+    if not changed and output_link.exists():
+        report(
+            f"No topology changes, output is up-to-date at {output_link.resolve()}",
+            event="store-path",
+            path=output_link.resolve(),
+            cached=True,
+        )
+        return
+
+    with phase(
+        "assemble",
+        f"== Building topology diagram ({'sources changed' if changed else 'output missing'}) ==",
+        changed=changed,
+    ):
+        subprocess.run(
+            [
+                "nix",
+                "build",
+                f"{DOCS}#topology.x86_64-linux.config.output",
+                "--override-input",
+                "configuration",
+                FLAKE,
+                # NOTE; The output link doubles as garbage collection root for the cached diagram
+                "--out-link",
+                output_link,
+            ],
+            check=True,
+        )
+
+    # NOTE; Fingerprints are only stored after a succesful build, so failed builds are retried next time
+    fingerprint_file.write_text(fingerprint)
+
+    report(
+        f"Topology output available at {output_link.resolve()}",
+        event="store-path",
+        path=output_link.resolve(),
+        cached=False,
     )
+
+
+@task
+# USAGE; invoke documentation [--incremental] [--watch] [--interval 2]
+def documentation(
+    c: Any, incremental: bool = False, watch: bool = False, interval: int = 2
+) -> None:
+    """
+    Build host and network documentation.
+
+    Incremental mode skips the build when no sources changed, watch mode rebuilds (incrementally) on each file change.
+    """
+    if not (incremental or watch):
+        subprocess.run(
+            [
+                "nix",
+                "build",
+                f"{DOCS}#topology.x86_64-linux.config.output",
+                "--override-input",
+                "configuration",
+                FLAKE,
+            ],
+            check=True,
+        )
+        return
+
+    documentation_build_incremental()
+    if not watch:
+        return
+
+    report(f"== Watching {FLAKE} and {DOCS} for changes, exit with CTRL+C ==")
+    previous_snapshot = snapshot_tree(FLAKE, DOCS)
+    try:
+        while True:
+            time.sleep(interval)
+            current_snapshot = snapshot_tree(FLAKE, DOCS)
+            if current_snapshot == previous_snapshot:
+                continue
+
+            # Wait until the editor(s) are done writing files
+            while True:
+                time.sleep(interval)
+                settled_snapshot = snapshot_tree(FLAKE, DOCS)
+                if settled_snapshot == current_snapshot:
+                    break
+                current_snapshot = settled_snapshot
+
+            previous_snapshot = current_snapshot
+            try:
+                documentation_build_incremental()
+            except subprocess.CalledProcessError as e:
+                # Keep watching, the next change probably fixes the configuration
+                report(f"Documentation build failed: {e}", event="error", error=str(e))
+    except KeyboardInterrupt:
+        pass
+
+
+# NOTE; Tab completion must be fast, so the completion function only reads the candidates precomputed into
+# COMPLETION_CACHE by completion_cache_update() and host_facts(). Anything else is delegated to the completion of
+# invoke itself, which imports this file (slow).
+COMPLETION_SCRIPT_BASH = r"""
+# Tab-completion for the tasks of Bert-Proesmans/nix, to be sourced with Bash shell.
+_complete_proesmans_invoke() {
+    local cache="${XDG_CACHE_HOME:-$HOME/.cache}/proesmans/completion"
+    local current="${COMP_WORDS[COMP_CWORD]}" previous="${COMP_WORDS[COMP_CWORD-1]}"
+    local task="" hostname="" file="secrets.encrypted.yaml" positional=0 index word
+    local -a tasks=() candidates=()
+
+    [[ -f "$cache/tasks" ]] && mapfile -t tasks <"$cache/tasks"
+
+    # Find the current task, its first positional argument and the selected secret file.
+    # NOTE; Multiple tasks can follow each other, eg "invoke batch --yes rebuild buddy"
+    for ((index = 1; index < COMP_CWORD; index++)); do
+        word="${COMP_WORDS[index]}"
+        case "$word" in
+        -f | --file)
+            file="${COMP_WORDS[index + 1]}"
+            index=$((index + 1))
+            ;;
+        -k | --key | --hostname | --push | --timeout | --interval | --initrd-port | --ssh-port)
+            index=$((index + 1))
+            ;;
+        -*) ;;
+        *)
+            if [[ " ${tasks[*]} " == *" $word "* ]]; then
+                task="$word" hostname="" file="secrets.encrypted.yaml" positional=0
+            else
+                [[ $positional -eq 0 ]] && hostname="$word"
+                positional=$((positional + 1))
+            fi
+            ;;
+        esac
+    done
+
+    case "$previous" in
+    -f | --file)
+        [[ -f "$cache/files/$hostname" ]] && mapfile -t candidates <"$cache/files/$hostname"
+        ;;
+    -k | --key)
+        case "$task" in
+        deploy | decrypter-key-create) file="keys.encrypted.yaml" ;;
+        esac
+        [[ -f "$cache/keys/$hostname/$file" ]] && mapfile -t candidates <"$cache/keys/$hostname/$file"
+        ;;
+    --hostname)
+        [[ -f "$cache/hosts" ]] && mapfile -t candidates <"$cache/hosts"
+        candidates+=(all)
+        ;;
+    *)
+        if [[ "$current" != -* && -z "$task" ]]; then
+            candidates=("${tasks[@]}")
+        elif [[ "$current" != -* && $positional -eq 0 ]]; then
+            case "$task" in
+            check | unlock | deploy | filesystem-rebuild | rebuild | secret-edit | ssh-key-create | decrypter-key-create)
+                [[ -f "$cache/hosts" ]] && mapfile -t candidates <"$cache/hosts"
+                ;;
+            esac
+            case "$task" in
+            check | unlock) candidates+=(all) ;;
+            esac
+        elif [[ "$current" != -* && $positional -eq 1 && "$task" == deploy ]]; then
+            [[ -f "$cache/connections" ]] && mapfile -t candidates <"$cache/connections"
+        fi
+        ;;
+    esac
+
+    if [[ ${#candidates[@]} -eq 0 ]]; then
+        # Options and everything else, ask invoke
+        candidates=($(invoke --complete -- ${COMP_WORDS[*]}))
+    fi
+    COMPREPLY=($(compgen -W "${candidates[*]}" -- "$current"))
+}
+
+complete -F _complete_proesmans_invoke -o default invoke inv
+"""
+
+
+@invoke_task
+# USAGE; source <(invoke completion)
+# USAGE; invoke completion --refresh >~/.local/share/bash-completion/completions/invoke
+def completion(c: Any, refresh: bool = False) -> None:
+    """
+    Print the bash completion script, completing host names, secret files and secret keys from cache.
+
+    --refresh rebuilds the cache, including the connection strings from the facts inventory (slow).
+    """
+    completion_cache_update(force=refresh)
+    if refresh:
+        host_facts()
+    print(COMPLETION_SCRIPT_BASH.lstrip())
+
+
+# NOTE; Last statement of this file, so all tasks are known
+completion_cache_update()